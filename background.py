@@ -1,7 +1,7 @@
 """This module is the background of the window"""
 
 import os
-from tkinter import Button, Label, Tk, Canvas, Text
+from tkinter import Button, Label, Tk, Canvas, Text, Widget
 from functools import partial
 from pathlib import Path
 import PIL.Image
@@ -14,6 +14,9 @@ from dictionaries import eval_color
 
 directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
 
+# the engine lines are read by the Tk loop once by frame while the engine is on
+ENGINE_REFRESH_MS = 33
+
 
 class Background:
     """The background of the window"""
@@ -34,6 +37,12 @@ class Background:
             bg=init_background_color,
         )
         self.canvas.place(x=0, y=0)
+        # the widgets positions and options set by update, to only set the
+        # ones which changed
+        self.layout_geometry: tuple | None = None
+        self.layout_positions: list[tuple[Widget, tuple]] = []
+        self.placed: dict[str, tuple] = {}
+        self.configured: dict[str, dict] = {}
         self.base_length = base_length
         self.master_window = master_window
         self.stockfish_reload_id = ""
@@ -99,6 +108,17 @@ class Background:
             background="#ffe6bd",
             font=("Arial", 10),
         )
+        self.opening = Label(
+            self.canvas,
+            text="",
+            bd=0,
+            wraplength=540, # mac 540, windows 700
+            width=90,
+            height=3,
+            background="#ffe6bd",
+            font=("Arial", 10),
+            justify="left",
+        )
         self.comments = []
         for _ in range(8):
             self.comments.append(
@@ -214,43 +234,20 @@ class Background:
         )
 
     def update(self, window: Tk, play_random, board_width, board_position):
-        """Update the background width and height"""
+        """Update the background width and height, only the widgets whose
+        position, text or state changed are updated"""
 
-        self.canvas.config(width=window.winfo_width(), height=window.winfo_height())
+        self.config(
+            self.canvas, width=window.winfo_width(), height=window.winfo_height()
+        )
 
-        self.random_move_btn.config(
+        self.config(
+            self.random_move_btn,
             text="RANDOM is " + ("OFF" if not play_random else "ON"),
             fg="#eb4034" if not play_random else "#34eb77",
         )
-        self.random_move_btn.place(
-            x=board_width + board_position + 50, y=board_position
-        )
-
-        self.flip_button.place(x=board_width + board_position + 10, y=board_position)
-        self.white_button.place(x=board_width + board_position + 190, y=board_position)
-        self.black_button.place(x=board_width + board_position + 250, y=board_position)
-        self.reset_button.place(x=board_width + board_position + 310, y=board_position)
-        self.take_back_button.place(
-            x=board_width + board_position + 370, y=board_position
-        )
-        self.move_text_box.place(x=board_width + board_position + 510, y=board_position)
-        self.move_eval_send.place(
-            x=board_width + board_position + 580, y=board_position
-        )
-        self.modify_comment.place(
-            x=board_width + board_position + 680, y=board_position
-        )
-        self.set_main_variant.place(
-            x=board_width + board_position + 780, y=board_position
-        )
-
-        self.save_repertoire.place(x=board_width + board_position + 50, y=board_width)
-        self.new_file.place(x=board_width + board_position + 190, y=board_width)
-        self.delete_move.place(x=board_width + board_position + 330, y=board_width)
-        self.compute_stockfish.place(
-            x=board_width + board_position + 470, y=board_width
-        )
-        self.export_pgn.place(x=board_width + board_position + 610, y=board_width)
+        for widget, position in self.layout(board_width, board_position):
+            self.place(widget, *position)
 
         if (
             len(self.master_window.board.repertoire_loaded_moves) > 0
@@ -266,44 +263,112 @@ class Background:
                 font = ("Arial", 10, "bold")
             else:
                 font = ("Arial", 10, "normal")
-            self.last_move.config(
-                text=move_full_print(last_move), fg=font_color, font=font
+            self.config(
+                self.last_move, text=move_full_print(last_move), fg=font_color, font=font
             )
-            self.last_move.place(
-                x=board_width + board_position + 50, y=board_position + 75
+            self.place(
+                self.last_move, board_width + board_position + 50, board_position + 75
             )
         else:
-            self.last_move.place_forget()
+            self.place_forget(self.last_move)
+
+        board = self.master_window.board
+        if board.current_opening is not None or len(board.opening_continuations) > 0:
+            opening_text = (
+                "" if board.current_opening is None else board.current_opening
+            )
+            if len(board.opening_continuations) > 0:
+                opening_text += "\n" + ", ".join(
+                    san + " " + name for san, name in board.opening_continuations
+                )
+            self.config(self.opening, text=opening_text)
+            self.place(self.opening, board_width + board_position + 50, board_width + 50)
+        else:
+            self.place_forget(self.opening)
 
         for i, comment in enumerate(self.comments):
             if len(self.master_window.board.current_comments) > i:
-                comment.config(text=self.master_window.board.current_comments[i][0])
-                comment["fg"] = self.master_window.board.current_comments[i][2]
-                if self.master_window.board.current_comments[i][1]:
-                    comment["font"] = ("Arial", 10, "bold")
-                else:
-                    comment["font"] = ("Arial", 10, "normal")
-                comment.place(
-                    x=board_width + board_position + 50, y=board_position + 150 + 75 * i
+                current_comment = self.master_window.board.current_comments[i]
+                self.config(
+                    comment,
+                    text=current_comment[0],
+                    fg=current_comment[2],
+                    font=(
+                        ("Arial", 10, "bold")
+                        if current_comment[1]
+                        else ("Arial", 10, "normal")
+                    ),
+                )
+                self.place(
+                    comment,
+                    board_width + board_position + 50,
+                    board_position + 150 + 75 * i,
                 )
             else:
-                comment.place_forget()
+                self.place_forget(comment)
 
         if (
             self.master_window.board.chess_board.fen()
             != "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
         ):
-            self.black_button["state"] = "disabled"
-            self.white_button["state"] = "disabled"
+            self.config(self.black_button, state="disabled")
+            self.config(self.white_button, state="disabled")
 
-            self.save_repertoire["state"] = "normal"
-            self.take_back_button["state"] = "normal"
+            self.config(self.save_repertoire, state="normal")
+            self.config(self.take_back_button, state="normal")
         else:
-            self.black_button["state"] = "normal"
-            self.white_button["state"] = "normal"
-
-            self.save_repertoire["state"] = "disabled"
-            self.take_back_button["state"] = "disabled"
+            self.config(self.black_button, state="normal")
+            self.config(self.white_button, state="normal")
+
+            self.config(self.save_repertoire, state="disabled")
+            self.config(self.take_back_button, state="disabled")
+
+    def layout(self, board_width, board_position) -> list[tuple[Widget, tuple]]:
+        """Get the positions of the buttons, computed once by board size"""
+
+        if self.layout_geometry == (board_width, board_position):
+            return self.layout_positions
+        x_0 = board_width + board_position
+        self.layout_geometry = (board_width, board_position)
+        self.layout_positions = [
+            (self.random_move_btn, (x_0 + 50, board_position)),
+            (self.flip_button, (x_0 + 10, board_position)),
+            (self.white_button, (x_0 + 190, board_position)),
+            (self.black_button, (x_0 + 250, board_position)),
+            (self.reset_button, (x_0 + 310, board_position)),
+            (self.take_back_button, (x_0 + 370, board_position)),
+            (self.move_text_box, (x_0 + 510, board_position)),
+            (self.move_eval_send, (x_0 + 580, board_position)),
+            (self.modify_comment, (x_0 + 680, board_position)),
+            (self.set_main_variant, (x_0 + 780, board_position)),
+            (self.save_repertoire, (x_0 + 50, board_width)),
+            (self.new_file, (x_0 + 190, board_width)),
+            (self.delete_move, (x_0 + 330, board_width)),
+            (self.compute_stockfish, (x_0 + 470, board_width)),
+            (self.export_pgn, (x_0 + 610, board_width)),
+        ]
+        return self.layout_positions
+
+    def place(self, widget: Widget, x, y):
+        """Place the widget if it's not already there"""
+
+        if self.placed.get(str(widget)) != (x, y):
+            widget.place(x=x, y=y)
+            self.placed[str(widget)] = (x, y)
+
+    def place_forget(self, widget: Widget):
+        if str(widget) in self.placed:
+            widget.place_forget()
+            self.placed.pop(str(widget))
+
+    def config(self, widget: Widget, **options):
+        """Configure the options of the widget which changed"""
+
+        configured = self.configured.setdefault(str(widget), {})
+        changed = {k: v for k, v in options.items() if configured.get(k) != v}
+        if len(changed) > 0:
+            widget.config(**changed)
+            configured.update(changed)
 
     def switch_random(self):
         self.master_window.board.switch_random()
@@ -342,19 +407,11 @@ class Background:
         self.master_window.board.switch_stockfish()
         self.compute_stockfish.config(
             text="stockfish is "
-            + (
-                "OFF"
-                if self.master_window.board.stockfish_sub_process is None
-                else "ON"
-            ),
-            fg=(
-                "#eb4034"
-                if self.master_window.board.stockfish_sub_process is None
-                else "#34eb77"
-            ),
+            + ("ON" if self.master_window.board.engine_on else "OFF"),
+            fg="#34eb77" if self.master_window.board.engine_on else "#eb4034",
         )
-        if self.master_window.board.stockfish_sub_process is None:
-            self.master_window.window.after_cancel(self.stockfish_reload_id)
+        if not self.master_window.board.engine_on:
+            self.stop_stockfish_refresh()
         else:
             self.stockfish.place(
                 x=self.master_window.board.board_width
@@ -362,22 +419,37 @@ class Background:
                 + 50,
                 y=self.master_window.board.board_width - 180,
             )
-            self.refresh_stockfish()
 
-    def refresh_stockfish(self):
-        try:
-            sf_log = open(directory_path / "stockfish.txt", "r", encoding="utf-8")
-        except FileNotFoundError:
+    def start_stockfish_refresh(self):
+        """Read the engine texts at the next frames, until its search is over"""
+
+        if self.stockfish_reload_id == "":
             self.stockfish_reload_id = self.master_window.window.after(
-            20, self.refresh_stockfish
+                ENGINE_REFRESH_MS, self.refresh_stockfish
             )
+
+    def stop_stockfish_refresh(self):
+        if self.stockfish_reload_id != "":
+            self.master_window.window.after_cancel(self.stockfish_reload_id)
+            self.stockfish_reload_id = ""
+
+    def refresh_stockfish(self):
+        """Show the last lines sent by the engine since the previous frame,
+        then read them again at the next frame while it is searching. It is
+        started again by Board.analyse_position with the next search, so
+        there is no wakeup when the engine is idle"""
+
+        self.stockfish_reload_id = ""
+        board = self.master_window.board
+        if board.engine is None or not board.engine_on:
             return
-        stockfish_text = sf_log.read()
-        sf_log.close()
-        self.stockfish.config(text=stockfish_text)
-        self.stockfish_reload_id = self.master_window.window.after(
-            20, self.refresh_stockfish
-        )
+        # read before the texts, the last texts are sent when it is False
+        searching = board.engine.searching()
+        stockfish_text = board.engine.last_update()
+        if stockfish_text is not None:
+            self.stockfish.config(text=stockfish_text)
+        if searching:
+            self.start_stockfish_refresh()
 
     def export_pgn_from_board(self):
         text = chess.Board().variation_san(
@@ -1,23 +1,20 @@
 """This module is the board of the window (only UI)"""
 
-import os
-import pickle
 import random
-import subprocess
 from tkinter import Tk, Canvas, Event
-from pathlib import Path
 import chess
-import PIL.Image
-import PIL.ImageTk
 
-from move import Move
+from engine import EngineService
+from move import Move, position_key
+from openings import load_opening_index, opening_at
+from piece_images import PieceImages
+from position_index import PositionIndex
+from repertoire_file import BinaryRepertoire
+from repertoire_store import SqliteRepertoire
 from utils import (
-    build_fen_dict,
-    find_all_children,
     is_not_a_bad_move,
+    load_repertoire,
     move_full_print,
-    parse_config,
-    traversal_tree,
     save_to_repertoire,
 )
 from dictionaries import (
@@ -29,8 +26,6 @@ from dictionaries import (
     reversed_eval_dict,
 )
 
-directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
-
 
 class Board:
     """The board of the window"""
@@ -53,23 +48,37 @@ class Board:
         self.black_color: str = "#2F1E0E"
         self.master_window = master_window
         self.arrows: list[str] = []
+        # start square of the arrows -> indices of their moves, for the hover
+        self.arrow_hit_map: dict[str, list[int]] = {}
+        self.hovered_square: str | None = None
         self.board_flipped: bool = False
         self.board_flipped_offset: int = self.nb_rows - 1
 
         self.white_to_play: bool = True
         self.chess_board = chess.Board()
         self.play_random = False
-        self.repertoire_fens = []
-        self.repertoire_moves: list[Move] = []
-        self.transposition_dict: dict[str, list[int]] = {}
+        self.repertoire_index: PositionIndex = PositionIndex()
         self.repertoire_loaded_moves: list[Move] = []
         self.player_color = "w"
         self.current_comments = []
-        self.stockfish_sub_process = None
+        self.engine: EngineService | None = None
+        self.engine_on = False
+        self.opening_index = load_opening_index()
+        self.current_opening: str | None = None
+        self.opening_continuations: list[tuple[str, str]] = []
+        self.update_opening()
 
         self.board_position: float = base_length * self.board_spacing
         self.board_width: float = base_length * (1 - 2 * self.board_spacing)
+        self.piece_images = PieceImages()
         self.load_images()
+        # the canvas items kept between two draws
+        self.drawn_base_length: float | None = None
+        self.drawn_flipped: bool | None = None
+        self.label_items: list[tuple[int, int]] = []
+        self.piece_items: dict[str, tuple[int, str]] = {}
+        self.arrow_items: list[int] = []
+        self.dragged_piece: int | None = None
         self.canvas: Canvas = Canvas(
             master=tk_window,
             width=self.board_width,
@@ -84,7 +93,9 @@ class Board:
     def update(self, base_length):
         """Update the board width and height and scale the drawing"""
 
-        self.board_width: float = base_length * (1 - 2 * self.board_spacing)
+        board_width: float = base_length * (1 - 2 * self.board_spacing)
+        size_changed = board_width != self.board_width
+        self.board_width: float = board_width
         self.board_position: float = base_length * self.board_spacing
 
         self.canvas.config(
@@ -95,7 +106,8 @@ class Board:
             x=self.board_position,
             y=self.board_position,
         )
-        self.load_images()
+        if size_changed:
+            self.load_images()
         self.draw()
 
     def bind(self):
@@ -108,31 +120,27 @@ class Board:
         self.canvas.bind("<Motion>", self.display_move_comment)
 
     def display_move_comment(self, event: Event):
-        self.current_comments = []
-        piece_x: int = event.x
-        piece_y: int = event.y
         base_length: float = self.board_width / self.nb_rows
-        init_piece_x_coord: int = int(piece_x / base_length)
-        init_piece_y_coord: int = int(piece_y / base_length)
-        arrow_ids = self.canvas.find_withtag(
-            str(init_piece_x_coord) + "com" + str(init_piece_y_coord)
-        )
-        tags = []
-        moves_to_display_comment = []
-        for arrow_id in arrow_ids:
-            tags.append(self.canvas.itemcget(arrow_id, "tags"))
-        for tag in tags:
-            if len(tag) > 6:
-                if tag[-1] == "t":
-                    move_idx = tag[tag.find(" ") + 1 : tag.find(" ", tag.find(" ") + 1)]
-                else:
-                    move_idx = tag[tag.find(" ") + 1 :]
-                moves_to_display_comment.append(self.repertoire_moves[int(move_idx)])
-        if len(moves_to_display_comment) < 1:
-            self.current_comments = []
-        else:
+        x_coord: int = int(event.x / base_length)
+        y_coord: int = int(event.y / base_length)
+        if self.board_flipped:
+            x_coord = self.board_flipped_offset - x_coord
+            y_coord = self.board_flipped_offset - y_coord
+        square = None
+        if x_coord in file_dict and y_coord in rank_dict:
+            square = file_dict[x_coord] + rank_dict[y_coord]
+        if square == self.hovered_square:
+            return
+        self.hovered_square = square
+        self.current_comments = []
+        moves_to_display_comment = [
+            self.repertoire_index.move_at(move_idx)
+            for move_idx in self.arrow_hit_map.get(square, [])  # type: ignore
+        ]
+        if len(moves_to_display_comment) > 0:
             self.update_comment_to_display(moves_to_display_comment)
-        self.master_window.update_canvas(None)
+        # only the comments changed
+        self.master_window.update_canvas(None, board=False)
 
     def select_piece(self, event: Event):
         """Select a piece to move"""
@@ -202,6 +210,7 @@ class Board:
         new_y: float = event.y
 
         # move the letter
+        self.dragged_piece = piece_id
         self.canvas.tag_raise(piece_id)
         self.canvas.coords(
             piece_id,
@@ -249,62 +258,42 @@ class Board:
             points = ". " if self.white_to_play else "... "
             new_move_san = f"{self.chess_board.fullmove_number}{points}{self.chess_board.san_and_push(chess.Move.from_uci(uci_move))}"
             self.white_to_play = not self.white_to_play
-            if self.stockfish_sub_process is not None:
-                self.kill_stockfish_sub_process(self.stockfish_sub_process)
-                self.switch_stockfish()
             if len(self.repertoire_loaded_moves) > 0:
-                truncated_fen = self.chess_board.fen()[
-                    : self.chess_board.fen().find(
-                        " ", self.chess_board.fen().find(" ") + 1
-                    )
-                ]
-                if truncated_fen in self.repertoire_fens:
-                    fen_idx = self.repertoire_fens.index(truncated_fen)
-                    indices = [
-                        i
-                        for i, x in enumerate(self.repertoire_fens)
-                        if x == truncated_fen
-                    ]
-                    if len(indices) > 1:
-                        for move_idx in indices:
-                            if self.repertoire_moves[move_idx].name == new_move_san:
-                                fen_idx = move_idx
-                                break
-                    if self.repertoire_moves[fen_idx].name != new_move_san:
+                truncated_fen = position_key(self.chess_board.fen())
+                repertoire_move = self.repertoire_index.find(truncated_fen, new_move_san)
+                if repertoire_move is not None:
+                    if repertoire_move.name != new_move_san:
                         # it's a new move despite finding the same fen
                         self.add_new_move_to_repertoire(new_move_san)
                         self.next_move(
                             self.repertoire_loaded_moves[-1], "b" if is_white else "w"
                         )
                     else:
-                        self.repertoire_loaded_moves.append(self.repertoire_moves[fen_idx])
-                        self.next_move(
-                            self.repertoire_moves[fen_idx], "b" if is_white else "w"
-                        )
+                        self.repertoire_loaded_moves.append(repertoire_move)
+                        self.next_move(repertoire_move, "b" if is_white else "w")
                 else:
                     # We don't find the fen in the list, it's a new move
                     self.add_new_move_to_repertoire(new_move_san)
+                    # next_move looks the position up in the other branches
+                    self.update_opening()
+                    self.analyse_position()
+            else:
+                self.update_opening()
+                self.analyse_position()
 
         self.master_window.update_canvas(None)
 
     def add_new_move_to_repertoire(self, new_move_san: str):
-        parent_truncated_fen = self.repertoire_loaded_moves[-1].fen[
-            : self.repertoire_loaded_moves[-1].fen.find(
-                " ", self.repertoire_loaded_moves[-1].fen.find(" ") + 1
-            )
-        ]
+        parent_truncated_fen = self.repertoire_loaded_moves[-1].fen_key
         parent = self.repertoire_loaded_moves[-1]
-        if parent_truncated_fen in self.transposition_dict:
+        if self.repertoire_index.is_transposition(parent_truncated_fen):
             # /!\ we have more than one move that transpose to this ie => more than 1 parent possible
-            for move_idx in self.transposition_dict[parent_truncated_fen]:
+            for transposed_move in self.repertoire_index.moves_at(parent_truncated_fen):
                 if (
-                    self.repertoire_moves[move_idx].comments is None
-                    or self.repertoire_moves[move_idx].comments.find(  # type: ignore
-                        "Transposition"
-                    )
-                    == -1
+                    transposed_move.comments is None
+                    or transposed_move.comments.find("Transposition") == -1
                 ):
-                    parent = self.repertoire_moves[move_idx]
+                    parent = transposed_move
                     break
         new_move = Move(
             name=new_move_san,
@@ -314,24 +303,40 @@ class Board:
         )
         parent.add_child(new_move)
         self.repertoire_loaded_moves.append(new_move)
-        self.repertoire_fens = []
-        self.repertoire_moves = []
-        traversal_tree(
-            self.repertoire_loaded_moves[0],
-            self.repertoire_fens,
-            self.repertoire_moves,
-        )
-        self.transposition_dict = build_fen_dict(self.repertoire_fens)
+        self.repertoire_index.add(new_move)
         self.arrows = []
+        self.arrow_hit_map = {}
 
     def draw(
         self,
     ):
-        """Draw the board with the pieces"""
-
-        self.canvas.delete("all")
+        """Draw the board with the pieces. The canvas items are kept between
+        two draws, only the ones which changed are updated"""
 
         base_length: float = self.board_width / self.nb_rows
+        if base_length != self.drawn_base_length:
+            self.draw_squares(base_length)
+        if self.board_flipped != self.drawn_flipped:
+            # draw the file and rank number/letter
+            for i, (file_item, rank_item) in enumerate(self.label_items):
+                piece_idx = i
+                if self.board_flipped:
+                    piece_idx = self.board_flipped_offset - i
+                self.canvas.itemconfig(file_item, text=file_dict[piece_idx])
+                self.canvas.itemconfig(rank_item, text=rank_dict[piece_idx])
+            self.drawn_flipped = self.board_flipped
+        self.draw_pieces(base_length)
+        self.draw_arrows()
+
+    def draw_squares(self, base_length: float):
+        """Draw the squares, the lines and the labels of the board for a new
+        size, the pieces and the arrows are drawn again on top of them"""
+
+        self.canvas.delete("all")
+        self.piece_items = {}
+        self.arrow_items = []
+        self.drawn_flipped = None
+        self.dragged_piece = None
 
         for i in range(0, self.nb_rows, 2):
             for j in range(0, self.nb_rows, 2):
@@ -357,34 +362,34 @@ class Board:
                 )
 
         for i in range(self.nb_rows + 1):
-            y_0: float = i * base_length
-            for j in range(self.nb_rows + 1):
-                x_0: float = j * base_length
-                self.canvas.create_line(
-                    x_0, 0, x_0, self.board_width, fill="black", width="1"
-                )
-                self.canvas.create_line(
-                    0, y_0, self.board_width, y_0, fill="black", width="1"
-                )
-        # draw the file and rank number/letter
+            x_0: float = i * base_length
+            self.canvas.create_line(
+                x_0, 0, x_0, self.board_width, fill="black", width="1"
+            )
+            self.canvas.create_line(
+                0, x_0, self.board_width, x_0, fill="black", width="1"
+            )
+
+        self.label_items = []
         for i in range(self.nb_rows):
-            piece_idx = i
-            if self.board_flipped:
-                piece_idx = self.board_flipped_offset - i
             y_0: float = i * base_length
-            self.canvas.create_text(
+            file_item = self.canvas.create_text(
                 y_0 + 0.9 * base_length,
                 self.board_width - 0.15 * base_length,
                 font=("Arial", int(base_length * 0.2)),
-                text=file_dict[piece_idx],
             )
-            self.canvas.create_text(
+            rank_item = self.canvas.create_text(
                 0.15 * base_length,
                 y_0 + 0.15 * base_length,
                 font=("Arial", int(base_length * 0.2)),
-                text=rank_dict[piece_idx],
             )
-        # draw the pieces
+            self.label_items.append((file_item, rank_item))
+        self.drawn_base_length = base_length
+
+    def draw_pieces(self, base_length: float):
+        """Update the pieces of the squares which changed since the last draw"""
+
+        board_str = str(self.chess_board).replace(" ", "").replace("\n", "")
         for i in range(0, self.nb_rows):
             x_idx = i
             if self.board_flipped:
@@ -395,35 +400,55 @@ class Board:
                     y_idx = self.nb_rows - 1 - j
                 x_0: float = x_idx * base_length
                 y_0: float = y_idx * base_length
-                piece_to_draw = (
-                    str(self.chess_board)
-                    .replace(" ", "")
-                    .replace("\n", "")[(j * self.nb_rows) + i]
-                )
-                self.draw_piece(
-                    x_0=x_0,
-                    y_0=y_0,
-                    piece=piece_to_draw,
-                    base_length=base_length,
-                    square_tag=str(y_idx) + ";" + str(x_idx),
-                )
-        self.draw_arrows()
+                piece_to_draw = board_str[(j * self.nb_rows) + i]
+                square_tag = str(y_idx) + ";" + str(x_idx)
+                drawn_piece = self.piece_items.get(square_tag)
+                if drawn_piece is not None and drawn_piece[0] == self.dragged_piece:
+                    # put back the dragged piece, it's updated just after
+                    self.canvas.coords(
+                        drawn_piece[0], x_0 + base_length / 2, y_0 + base_length / 2
+                    )
+                if drawn_piece is not None and drawn_piece[1] == piece_to_draw:
+                    continue
+                if drawn_piece is None:
+                    piece_item = self.draw_piece(
+                        x_0=x_0,
+                        y_0=y_0,
+                        piece=piece_to_draw,
+                        base_length=base_length,
+                        square_tag=square_tag,
+                    )
+                    if piece_item is not None:
+                        self.piece_items[square_tag] = (piece_item, piece_to_draw)
+                elif piece_to_draw == ".":
+                    self.canvas.delete(drawn_piece[0])
+                    self.piece_items.pop(square_tag)
+                else:
+                    self.canvas.itemconfig(
+                        drawn_piece[0], image=self.images_dict[piece_to_draw]
+                    )
+                    self.piece_items[square_tag] = (drawn_piece[0], piece_to_draw)
+        self.dragged_piece = None
 
     def draw_piece(
         self, x_0: float, y_0: float, piece: str, base_length: float, square_tag: str
-    ):
+    ) -> int | None:
         """Draw the pieces on the board"""
 
         base_length_50: float = base_length / 2
         if piece != ".":
-            self.canvas.create_image(
+            return self.canvas.create_image(
                 x_0 + base_length_50,
                 y_0 + base_length_50,
                 image=self.images_dict[piece],
                 tags=square_tag,
             )
+        return None
 
     def draw_arrows(self):
+        for arrow_item in self.arrow_items:
+            self.canvas.delete(arrow_item)
+        self.arrow_items = []
         base_length: float = self.board_width / self.nb_rows
         for arrow in self.arrows:
             base_length_50 = base_length / 2
@@ -451,13 +476,13 @@ class Board:
             y0 = (rank_idx_start_arrow * base_length) + base_length_50
             fill = "#000000" if arrow[4] == "1" else "#949494"
             width = 13 if arrow[4] == "1" else 5
-            move = self.repertoire_moves[int(arrow[5:])]
+            move = self.repertoire_index.move_at(int(arrow[5:]))
             if move.evaluation:
                 for chess_eval in move.evaluation:
                     if chess_eval in list(eval_color.keys()):
                         fill = eval_color[chess_eval]
                         break
-            self.canvas.create_line(
+            arrow_item = self.canvas.create_line(
                 x0,
                 y0,
                 x1,
@@ -465,44 +490,26 @@ class Board:
                 arrow="last",
                 width=width,
                 fill=fill,
-                tags=[
-                    str(file_idx_start_arrow) + "com" + str(rank_idx_start_arrow),
-                    arrow[5:],
-                ],
             )
+            self.arrow_items.append(arrow_item)
 
     def load_images(self):
-        """Load the images and save it to the board object images_dict"""
+        """Get the images of the current size and save it to the board object
+        images_dict"""
         base_length: float = self.board_width / self.nb_rows
-        images_dict = {}
-        for file in os.listdir(directory_path / "images" / "pieces"):
-            if file.endswith(".png"):
-                full_path_file = directory_path / "images" / "pieces" / file
-                image_file = PIL.Image.open(full_path_file)
-                image_file = image_file.resize((int(base_length), int(base_length)))
-                piece = file[1] if file[0] == "b" else file[1].upper()
-                images_dict[piece] = PIL.ImageTk.PhotoImage(image_file)
-        self.images_dict = images_dict
+        self.images_dict = self.piece_images.get(int(base_length))
 
     def switch_random(self):
         self.play_random = not self.play_random
 
     def choose_color(self, b_or_w):
         self.reset_game()
-        with open(
-                directory_path / "repertoire" / (b_or_w + ".repertoire.pickle"),
-            "rb",
-        ) as handle:
-            self.repertoire_loaded_moves.append(pickle.load(handle))
-        traversal_tree(
-            self.repertoire_loaded_moves[-1],
-            self.repertoire_fens,
-            self.repertoire_moves,
-        )
+        fake_move, repertoire = load_repertoire(b_or_w)
+        self.repertoire_loaded_moves.append(fake_move)
+        self.repertoire_index = PositionIndex(fake_move, repertoire)
         self.board_flipped = b_or_w == "b"
         self.master_window.update_canvas(None)
 
-        self.transposition_dict = build_fen_dict(self.repertoire_fens)
         self.player_color = b_or_w
         self.next_move(self.repertoire_loaded_moves[-1], b_or_w)
 
@@ -521,6 +528,8 @@ class Board:
 
     def next_move(self, move, b_or_w, play_main_variant=False):
         self.arrows = []
+        self.arrow_hit_map = {}
+        self.hovered_square = None
         self.current_comments = []
         self.draw_arrows()
 
@@ -533,61 +542,52 @@ class Board:
             color = "w"
 
         new_move = move
+        graph = self.repertoire_index.graph
         if color == b_or_w and self.play_random and self.player_color == color:
-            idx = self.repertoire_moves.index(move)
-            all_children = find_all_children(
-                self.transposition_dict,
-                self.repertoire_fens[idx],
-                self.repertoire_moves,
-                idx,
-                False,
-            )
             # pick a random move
-            random_move = random.choice(list(filter(is_not_a_bad_move, all_children)))
-            new_move = random_move
+            random_edge = random.choice(
+                [e for e in graph.edges(move) if is_not_a_bad_move(e.move)]
+            )
+            new_move = random_edge.move
             self.repertoire_loaded_moves.append(new_move)
-            self.chess_board.push_san(new_move.name[new_move.name.find(" ") + 1 :])
+            self.chess_board.push_uci(random_edge.uci)
             self.white_to_play = not self.white_to_play
             self.master_window.update_canvas(None)
 
         if play_main_variant:
-            idx = self.repertoire_moves.index(move)
-            all_children = find_all_children(
-                self.transposition_dict,
-                self.repertoire_fens[idx],
-                self.repertoire_moves,
-                idx,
-                False,
-            )
-            if len(all_children) > 0:
+            edges = graph.edges(move)
+            if len(edges) > 0:
                 # pick the main variant move
-                all_children.sort(key=lambda c: int(not c.main_variant))
-                new_move = all_children[0]
+                main_edge = sorted(edges, key=lambda e: int(not e.main_variant))[0]
+                new_move = main_edge.move
                 self.repertoire_loaded_moves.append(new_move)
-                self.chess_board.push_san(new_move.name[new_move.name.find(" ") + 1 :])
+                self.chess_board.push_uci(main_edge.uci)
                 self.white_to_play = not self.white_to_play
                 self.master_window.update_canvas(None)
 
-        idx = self.repertoire_moves.index(new_move)
-        all_children = find_all_children(
-            self.transposition_dict,
-            self.repertoire_fens[idx],
-            self.repertoire_moves,
-            idx,
-            False,
-        )
-        for c in all_children:
-            test_fen = c.fen[: c.fen.find(" ", c.fen.find(" ") + 1)]
-            move_idx = self.repertoire_moves.index(c)
-            if test_fen in self.transposition_dict.keys():
-                for concurent_move_idx in self.transposition_dict[test_fen]:
-                    if self.repertoire_moves[concurent_move_idx].name == c.name:
-                        move_idx = concurent_move_idx
-                        break
-            uci_move = str(self.chess_board.parse_san(c.name[c.name.find(" ") + 1 :]))
-            main_var = "1" if c.main_variant else "0"
-            self.arrows.append(uci_move + main_var + str(move_idx))
+        for edge in graph.edges(new_move):
+            main_var = "1" if edge.main_variant else "0"
+            self.arrows.append(edge.uci + main_var + str(edge.idx))
+            self.arrow_hit_map.setdefault(edge.uci[:2], []).append(edge.idx)
         self.draw_arrows()
+        self.update_opening()
+        self.analyse_position()
+
+    def update_opening(self):
+        """Find the opening of the line on the board and its named
+        continuations (as san, name) in the opening index"""
+
+        self.current_opening, continuations = opening_at(
+            self.opening_index,
+            [move.uci() for move in self.chess_board.move_stack],
+            position_key(self.chess_board.fen()),
+        )
+        self.opening_continuations = []
+        for uci_move, name in continuations:
+            move = chess.Move.from_uci(uci_move)
+            # the transposed position may not have the same castling rights
+            if self.chess_board.is_legal(move):
+                self.opening_continuations.append((self.chess_board.san(move), name))
 
     def take_back_last_event(self, _: Event):
         if (
@@ -614,62 +614,65 @@ class Board:
             deleted_move.parent.children.pop(
                 deleted_move.parent.children.index(deleted_move)
             )
-            self.repertoire_fens = []
-            self.repertoire_moves = []
-            traversal_tree(
-                self.repertoire_loaded_moves[0],
-                self.repertoire_fens,
-                self.repertoire_moves,
-            )
-            self.transposition_dict = build_fen_dict(self.repertoire_fens)
+            self.repertoire_index.remove(deleted_move)
         self.next_move(
             self.repertoire_loaded_moves[-1], "w" if self.white_to_play else "b"
         )
         self.current_comments = []
         self.master_window.update_canvas(None)
-        if self.stockfish_sub_process is not None:
-            self.kill_stockfish_sub_process(self.stockfish_sub_process)
-            self.switch_stockfish()
 
     def reset_game(self):
         self.white_to_play = True
         self.chess_board = chess.Board()
         self.play_random = False
-        self.repertoire_fens = []
-        self.repertoire_moves = []
-        self.transposition_dict = {}
+        self.repertoire_index.close()
+        self.repertoire_index = PositionIndex()
         self.repertoire_loaded_moves = []
         self.arrows = []
+        self.arrow_hit_map = {}
+        self.hovered_square = None
         self.player_color = "w"
         self.board_flipped = False
         self.current_comments = []
-        if self.stockfish_sub_process is not None:
+        self.update_opening()
+        if self.engine_on:
             self.master_window.background.compute_stockfish_score()
         self.master_window.background.stockfish.place_forget()
         self.master_window.update_canvas(None)
 
     def flip_board(self):
         self.board_flipped = not self.board_flipped
+        self.hovered_square = None
         self.master_window.update_canvas(None)
 
     def save_to_repertoire(self):
-        save_to_repertoire(self.player_color, self.repertoire_loaded_moves[0])
+        if isinstance(self.repertoire_index.repertoire, SqliteRepertoire):
+            # the edits are already written in the store, only commit them
+            self.repertoire_index.repertoire.commit()
+            print("repertoire saved!")
+        else:
+            if isinstance(self.repertoire_index.repertoire, BinaryRepertoire):
+                # the tree is read from the file which is going to be replaced
+                self.repertoire_index.detach(self.repertoire_loaded_moves[0])
+            save_to_repertoire(self.player_color, self.repertoire_loaded_moves[0])
 
     def modify_last_move_eval(self, move_evals: list[str]):
         if move_evals[0] == "":
             self.repertoire_loaded_moves[-1].evaluation = None
+            self.repertoire_index.update(self.repertoire_loaded_moves[-1])
             return
-        if self.repertoire_loaded_moves[-1].evaluation is None:
-            self.repertoire_loaded_moves[-1].evaluation = []
+        # a new list, the current one may be shared (edges, the index)
+        evaluation = list(self.repertoire_loaded_moves[-1].evaluation or [])
         for move_eval in move_evals:
             if move_eval in reversed_eval_dict:
-                self.repertoire_loaded_moves[-1].evaluation.append(
-                    reversed_eval_dict[move_eval]
-                )
+                evaluation.append(reversed_eval_dict[move_eval])
+        self.repertoire_loaded_moves[-1].evaluation = evaluation
+        self.repertoire_index.update(self.repertoire_loaded_moves[-1])
         self.master_window.update_canvas(None)
 
     def modify_last_move_comment(self, move_comment: str):
         self.repertoire_loaded_moves[-1].comments = move_comment
+        self.repertoire_index.update(self.repertoire_loaded_moves[-1])
         self.master_window.update_canvas(None)
 
     def new_file_for_last_move(self):
@@ -678,6 +681,7 @@ class Board:
                 self.repertoire_loaded_moves[-1]
             )
             self.repertoire_loaded_moves[-1].parent.children.pop(children_idx)
+            self.repertoire_index.remove(self.repertoire_loaded_moves[-1])
         new_path_moves = []
         parent = self.repertoire_loaded_moves[-1]
         while parent is not None and parent.name != "":
@@ -704,6 +708,7 @@ class Board:
             file_header=file_header,
         )
         self.repertoire_loaded_moves[0].add_child(last_move_added)
+        self.repertoire_index.add(last_move_added)
         for move in new_path_moves[1:]:
             new_move_added = Move(
                 name=move[0],
@@ -715,37 +720,40 @@ class Board:
                 file_header=None,
             )
             last_move_added.add_child(new_move_added)
+            self.repertoire_index.add(new_move_added)
             last_move_added = new_move_added
+        # the moved move is out of the tree (and of the index), the next edits
+        # are made on its copy in the new file
+        self.repertoire_loaded_moves[-1] = last_move_added
 
     def switch_stockfish(self):
-        if self.stockfish_sub_process is not None:
-            self.kill_stockfish_sub_process(self.stockfish_sub_process)
+        if self.engine_on:
+            self.engine.stop()  # type: ignore
+            self.engine_on = False
         else:
-            config = parse_config()
-            p = subprocess.Popen(
-                args=[
-                    config["python_exec_command"],
-                    directory_path / "stockfish.py",
-                    self.chess_board.fen(),
-                ]
-            )
-            self.stockfish_sub_process = p
+            if self.engine is None:
+                # started once, then kept to analyse the next positions
+                self.engine = EngineService()
+            self.engine_on = True
+            self.analyse_position()
+
+    def analyse_position(self):
+        """Send the position of the board to the engine if it's on"""
 
-    def kill_stockfish_sub_process(self, sub_process: subprocess.Popen):
-        sub_process.kill()
-        self.stockfish_sub_process = None
+        if self.engine_on:
+            self.engine.analyse(self.chess_board)  # type: ignore
+            # the texts of this position are read until its search is over
+            self.master_window.background.start_stockfish_refresh()
 
     def set_last_move_to_main_variant(self):
         if len(self.repertoire_loaded_moves) < 1:
             return
-        idx = self.repertoire_moves.index(self.repertoire_loaded_moves[-1].parent)  # type: ignore
-        all_children = find_all_children(
-            self.transposition_dict,
-            self.repertoire_fens[idx],
-            self.repertoire_moves,
-            idx,
-            False,
+        edges = self.repertoire_index.graph.edges(
+            self.repertoire_loaded_moves[-1].parent  # type: ignore
         )
-        for c in all_children:
-            c.main_variant = False
+        for edge in edges:
+            for c in edge.moves:
+                c.main_variant = False
+                self.repertoire_index.update(c)
         self.repertoire_loaded_moves[-1].main_variant = True
+        self.repertoire_index.update(self.repertoire_loaded_moves[-1])
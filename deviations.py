@@ -0,0 +1,60 @@
+"""This module implements the search of the deviations of a repertoire"""
+
+from typing import Iterator
+
+from dictionaries import reversed_eval_dict
+from move import Move
+from position_index import PositionIndex
+from utils import is_not_a_bad_move
+
+
+def glyph_to_nag(glyph: str) -> str:
+    """Get the $n evaluation of a glyph like ! or ?!, a $n is kept as is"""
+
+    if glyph in reversed_eval_dict:
+        return reversed_eval_dict[glyph]
+    if glyph.startswith("$"):
+        return glyph
+    raise ValueError("This evaluation glyph is not known: " + glyph)
+
+
+def find_deviations(
+    root: Move, color: str, min_depth: int = 0, glyph: str | None = None
+) -> Iterator[tuple[Move, list[Move]]]:
+    """Yield (move, children) for every position where the color to play has
+    more than one good move, the children of the transposed moves included.
+    Each position is yielded once, in the order of the tree, as soon as it is
+    found. Only the positions after min_depth half moves and, with a glyph,
+    the ones having a child evaluated with it are yielded"""
+
+    nag = None if glyph is None else glyph_to_nag(glyph)
+    index = PositionIndex(root)
+    seen = set()
+    stack = [(0, root)]
+    while len(stack) > 0:
+        depth, move = stack.pop()
+        for child in reversed(move.children):
+            stack.append((depth + 1, child))
+        if (
+            move.fen_key in seen
+            or depth < min_depth
+            or not move.fen_key.endswith(color)
+        ):
+            continue
+        seen.add(move.fen_key)
+        # dict.fromkeys keeps the order and merges the transposed children
+        all_children = list(
+            dict.fromkeys(
+                child
+                for transposed_move in index.moves_at(move.fen_key)
+                for child in transposed_move.children
+            )
+        )
+        if len(list(filter(is_not_a_bad_move, all_children))) < 2:
+            continue
+        if nag is not None and not any(
+            child.evaluation is not None and nag in child.evaluation
+            for child in all_children
+        ):
+            continue
+        yield move, all_children
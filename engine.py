@@ -0,0 +1,264 @@
+"""This module implements the engine analysing the positions of the board"""
+
+import os
+import queue
+import re
+import threading
+from pathlib import Path
+import chess
+import chess.engine
+
+from evaluation_cache import EvaluationCache
+from utils import parse_config
+
+directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
+evaluation_cache_path = directory_path / "cache" / "evaluations.sqlite"
+
+# a score moving by at most STABLE_SCORE_MARGIN centipawns is still stable
+STABLE_SCORE_MARGIN = 15
+
+
+def analysis_multipv(config: dict[str, str]) -> int:
+    """The number of lines shown by the GUI and cached by position"""
+
+    return int(config.get("analysis_multipv", 4))
+
+
+def analysis_limit(config: dict[str, str]) -> chess.engine.Limit:
+    """The limit of the search of a position, the movetime is in milliseconds
+    and 0 means no limit"""
+
+    depth = int(config.get("analysis_depth", 30))
+    nodes = int(config.get("analysis_nodes", 0))
+    movetime = int(config.get("analysis_movetime", 0))
+    return chess.engine.Limit(
+        depth=depth if depth > 0 else None,
+        nodes=nodes if nodes > 0 else None,
+        time=movetime / 1000 if movetime > 0 else None,
+    )
+
+
+def popen_engine(threads: int, hash_size: int) -> chess.engine.SimpleEngine:
+    """Start the configured uci engine with this number of threads and this
+    hash size in MB"""
+
+    engine = chess.engine.SimpleEngine.popen_uci(
+        Path(parse_config()["stockfish_path"])
+    )
+    engine.configure({"Threads": threads, "Hash": hash_size})
+    return engine
+
+
+def engine_name(engine: chess.engine.SimpleEngine) -> str:
+    return engine.id.get("name", parse_config()["stockfish_path"])
+
+
+def open_evaluation_cache() -> EvaluationCache:
+    return EvaluationCache(
+        evaluation_cache_path,
+        int(parse_config().get("evaluation_cache_size", 200000)),
+    )
+
+
+def info_line(board: chess.Board, info: chess.engine.InfoDict) -> str:
+    """Get the text of a line of the analysis: its score then its moves"""
+
+    variation = board.variation_san(info["pv"][:30])
+    variation = re.sub(r"\.\ ", ".", variation)
+    return (
+        str(info["score"].white().score(mate_score=300) / 100)  # type: ignore
+        + " / "
+        + variation
+    )
+
+
+class StableSearch:
+    """Follows the best move and score of each depth of a search, the search
+    is stable when they didn't change for `iterations` depths. 0 iterations
+    never stops the search"""
+
+    def __init__(self, iterations: int, margin: int = STABLE_SCORE_MARGIN):
+        self.iterations = iterations
+        self.margin = margin
+        self.move: chess.Move | None = None
+        self.score: int | None = None
+        self.since = 0
+
+    def update(self, depth: int, move: chess.Move, score: int | None) -> bool:
+        """Give the best line of a finished depth, True if the search can stop"""
+
+        if (
+            move != self.move
+            or score is None
+            or self.score is None
+            or abs(score - self.score) > self.margin
+        ):
+            self.move = move
+            self.score = score
+            self.since = depth
+        return self.iterations > 0 and depth - self.since >= self.iterations
+
+
+def analysis_text(depth: int, moves_score_str: dict[int, str]) -> str:
+    return (
+        "profondeur : "
+        + str(depth)
+        + "\n"
+        + str(moves_score_str).replace(", ", "\n").replace("'", "")[1:-1]
+    )
+
+
+class EngineService:
+    """The uci engine of the GUI, started once and kept while the window is
+    open. A new position is sent with stop, position and go, so there is no
+    startup cost by move and the hash table is kept. The analysis is read in
+    a thread which only puts the texts in updates, the Tk loop reads them with
+    last_update while searching (Tk can't be called from another thread). The
+    evaluations are saved by depth in the evaluation cache, a cached
+    evaluation is shown at once and only the deeper ones are searched. The
+    search stops at the configured limit, or sooner when its best move and
+    score are stable"""
+
+    def __init__(self):
+        config = parse_config()
+        self.multipv = analysis_multipv(config)
+        self.limit = analysis_limit(config)
+        self.stable_iterations = int(config.get("analysis_stable_iterations", 6))
+        self.engine = popen_engine(
+            int(config["stockfish_threads"]), int(config["stockfish_hash_size"])
+        )
+        self.engine_name = engine_name(self.engine)
+        self.cache = open_evaluation_cache()
+        self.analysis: chess.engine.SimpleAnalysisResult | None = None
+        self.fen: str | None = None
+        self.updates: queue.Queue[str] = queue.Queue()
+        # the thread reading the current analysis
+        self.reader: threading.Thread | None = None
+
+    def analyse(self, board: chess.Board):
+        """Start the analysis of the position of the board, stopping the
+        analysis of the previous one"""
+
+        if board.fen() == self.fen:
+            return
+        self.stop()
+        # the lines of the previous position are not shown
+        self.last_update()
+        self.fen = board.fen()
+        cached_depth = 0
+        stable = False
+        moves_score_str: dict[int, str] = {}
+        cached = self.cache.get(board.epd(), self.engine_name, self.multipv)
+        if cached is not None:
+            cached_depth, _, moves_score_str, stable = cached
+            self.send(analysis_text(cached_depth, moves_score_str))
+        if stable or (
+            self.limit.depth is not None and cached_depth >= self.limit.depth
+        ):
+            # already searched enough, no engine time for it
+            return
+        analysis = self.engine.analysis(board, self.limit, multipv=self.multipv)
+        self.analysis = analysis
+        self.reader = threading.Thread(
+            target=self.read_analysis,
+            args=(analysis, board.copy(), cached_depth, moves_score_str),
+            daemon=True,
+        )
+        self.reader.start()
+
+    def read_analysis(
+        self,
+        analysis: chess.engine.SimpleAnalysisResult,
+        board: chess.Board,
+        cached_depth: int,
+        moves_score_str: dict[int, str],
+    ):
+        current_depth = cached_depth
+        best_move = None
+        best_score = None
+        stable_search = StableSearch(self.stable_iterations)
+        # (depth, multipv) -> line already sent
+        sent_lines: dict[tuple[int, int], str] = {}
+        for info in analysis:
+            if analysis is not self.analysis:
+                # the engine analyses another position now
+                return
+            if info.get("score") is None or info.get("pv") is None:
+                continue
+            depth = info.get("depth", 0)
+            multipv = info.get("multipv", 1)
+            if depth <= cached_depth:
+                continue
+            if depth > current_depth:
+                if current_depth > cached_depth:
+                    # all the lines of the previous depth are in
+                    stable = stable_search.update(
+                        current_depth, best_move, best_score  # type: ignore
+                    )
+                    self.cache.put(
+                        board.epd(),
+                        self.engine_name,
+                        self.multipv,
+                        current_depth,
+                        best_score,
+                        moves_score_str,
+                        stable,
+                    )
+                    if stable:
+                        # the same line for a while, the engine is freed
+                        analysis.stop()
+                        return
+                current_depth = depth
+            line = info_line(board, info)
+            if sent_lines.get((depth, multipv)) == line:
+                continue
+            sent_lines[(depth, multipv)] = line
+            moves_score_str[multipv] = line
+            if multipv == 1:
+                best_move = info["pv"][0]
+                best_score = info["score"].white().score(mate_score=30000)
+            self.send(analysis_text(depth, moves_score_str))
+        if (
+            analysis is self.analysis
+            and self.limit.depth is not None
+            and current_depth >= self.limit.depth
+        ):
+            # the last depth is only finished when the search stopped at it
+            self.cache.put(
+                board.epd(),
+                self.engine_name,
+                self.multipv,
+                current_depth,
+                best_score,
+                moves_score_str,
+            )
+
+    def searching(self) -> bool:
+        """True while the analysis can still send texts. Its last texts are
+        already in updates once it is False"""
+
+        return self.reader is not None and self.reader.is_alive()
+
+    def send(self, text: str):
+        self.updates.put(text)
+
+    def last_update(self) -> str | None:
+        """Get the last text of the analysis sent since the last call"""
+
+        text = None
+        while True:
+            try:
+                text = self.updates.get_nowait()
+            except queue.Empty:
+                return text
+
+    def stop(self):
+        if self.analysis is not None:
+            self.analysis.stop()
+        self.analysis = None
+        self.fen = None
+
+    def quit(self):
+        self.stop()
+        self.engine.quit()
+        self.cache.close()
@@ -0,0 +1,156 @@
+"""This module implements the cache of the engine evaluations, kept on disk"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    position TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    multipv INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    score INTEGER,
+    lines TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    stable INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (position, engine, multipv)
+);
+CREATE INDEX IF NOT EXISTS evaluations_last_used ON evaluations (last_used);
+"""
+
+# the last uses of the read evaluations are written by batches of this size
+LAST_USED_BATCH = 50
+
+
+class EvaluationCache:
+    """The deepest evaluation found for a position (its epd, the castling and
+    en passant rights change the evaluation) by an engine with a number of
+    lines. An evaluation is stable when the search was stopped because its
+    best move and score didn't change anymore. When there are more than
+    max_positions evaluations, the least recently used ones are removed, the
+    last uses are kept in memory until the next write. It can be used from
+    several threads"""
+
+    def __init__(self, path: Path, max_positions: int = 200000):
+        path.parent.mkdir(exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        columns = [
+            column[1]
+            for column in self.connection.execute("PRAGMA table_info(evaluations)")
+        ]
+        if "stable" not in columns:
+            # a cache written before the stable evaluations
+            self.connection.execute(
+                "ALTER TABLE evaluations ADD COLUMN stable INTEGER NOT NULL DEFAULT 0"
+            )
+        self.lock = threading.Lock()
+        self.max_positions = max_positions
+        # (position, engine, multipv) -> last use not written yet
+        self.last_used: dict[tuple[str, str, int], float] = {}
+
+    def close(self):
+        with self.lock:
+            self.write_last_used()
+            self.connection.commit()
+            self.connection.close()
+
+    def write_last_used(self):
+        """Write the last uses kept in memory, the caller holds the lock and
+        commits"""
+
+        self.connection.executemany(
+            """UPDATE evaluations SET last_used = ?
+            WHERE position = ? AND engine = ? AND multipv = ?""",
+            [(used, *key) for key, used in self.last_used.items()],
+        )
+        self.last_used = {}
+
+    def get(
+        self, position: str, engine: str, multipv: int
+    ) -> tuple[int, int | None, dict[int, str], bool] | None:
+        """Get the (depth, score, lines by multipv, stable) of the position"""
+
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT depth, score, lines, stable FROM evaluations
+                WHERE position = ? AND engine = ? AND multipv = ?""",
+                (position, engine, multipv),
+            ).fetchone()
+            if row is None:
+                return None
+            self.last_used[(position, engine, multipv)] = time.time()
+            if len(self.last_used) >= LAST_USED_BATCH:
+                self.write_last_used()
+                self.connection.commit()
+        lines = {int(k): v for k, v in json.loads(row[2]).items()}
+        return row[0], row[1], lines, bool(row[3])
+
+    def status(self, position: str, engine: str, multipv: int) -> tuple[int, bool]:
+        """Get the (depth, stable) of the cached evaluation of the position,
+        (0, False) if there is none"""
+
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT depth, stable FROM evaluations
+                WHERE position = ? AND engine = ? AND multipv = ?""",
+                (position, engine, multipv),
+            ).fetchone()
+        return (0, False) if row is None else (row[0], bool(row[1]))
+
+    def put(
+        self,
+        position: str,
+        engine: str,
+        multipv: int,
+        depth: int,
+        score: int | None,
+        lines: dict[int, str],
+        stable: bool = False,
+    ):
+        """Save the evaluation of the position if it's deeper than the cached
+        one, or as deep but now stable"""
+
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT depth, stable FROM evaluations
+                WHERE position = ? AND engine = ? AND multipv = ?""",
+                (position, engine, multipv),
+            ).fetchone()
+            if row is not None and (
+                row[0] > depth or (row[0] == depth and (row[1] or not stable))
+            ):
+                return
+            self.connection.execute(
+                """INSERT OR REPLACE INTO evaluations
+                (position, engine, multipv, depth, score, lines, last_used, stable)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    position,
+                    engine,
+                    multipv,
+                    depth,
+                    score,
+                    json.dumps(lines),
+                    time.time(),
+                    int(stable),
+                ),
+            )
+            self.write_last_used()
+            if row is None:
+                # counted in the transaction, another process (the GUI or
+                # analyze_repertoire) can write the same file
+                count = self.connection.execute(
+                    "SELECT COUNT(*) FROM evaluations"
+                ).fetchone()[0]
+                if count > self.max_positions:
+                    self.connection.execute(
+                        """DELETE FROM evaluations WHERE rowid IN (
+                            SELECT rowid FROM evaluations ORDER BY last_used LIMIT ?
+                        )""",
+                        (count - self.max_positions,),
+                    )
+            self.connection.commit()
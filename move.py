@@ -1,9 +1,38 @@
 """This module implements a chess Move"""
 
+import sys
+
+from traversal import ancestors
+
+
+def position_key(fen: str) -> str:
+    """Get the fen with the color but without the move order, castle, etc.
+    to find the transpositions"""
+
+    return fen[: fen.find(" ", fen.find(" ") + 1)]
+
+
+def intern_or_none(string: str | None) -> str | None:
+    """Share the same string object between all the moves using it"""
+
+    return None if string is None else sys.intern(string)
+
 
 class Move:
     """this class is a chess Move"""
 
+    __slots__ = (
+        "name",
+        "parent",
+        "_fen",
+        "fen_key",
+        "_comments",
+        "_evaluation",
+        "children",
+        "main_variant",
+        "file_header",
+    )
+
     def __init__(
         self,
         name,
@@ -14,15 +43,68 @@ class Move:
         main_variant=True,
         file_header=None,
     ):
-        self.name: str = name
+        self.name: str = sys.intern(name)
         self.parent: Move | None = parent
-        self.fen: str = fen
-        self.comments: str | None = comments
-        self.evaluation: list[str] | None = evaluation
+        self.fen = fen
+        self.comments = comments
+        self.evaluation = evaluation
         self.children: list[Move] = []
         self.main_variant: bool = main_variant
         self.file_header: str | None = file_header
 
+    @property
+    def fen(self) -> str:
+        return self._fen
+
+    @fen.setter
+    def fen(self, fen: str):
+        # the position key is computed once here, not on every __eq__/__hash__
+        self._fen: str = fen
+        self.fen_key: str = sys.intern(position_key(fen))
+
+    # the comments and the NAGs repeat a lot in a repertoire, they are interned
+    # when they are set so all the moves share the same strings
+    @property
+    def comments(self) -> str | None:
+        return self._comments
+
+    @comments.setter
+    def comments(self, comments: str | None):
+        self._comments: str | None = intern_or_none(comments)
+
+    @property
+    def evaluation(self) -> list[str] | None:
+        return self._evaluation
+
+    @evaluation.setter
+    def evaluation(self, evaluation: list[str] | None):
+        self._evaluation: list[str] | None = (
+            None if evaluation is None else [sys.intern(e) for e in evaluation]
+        )
+
+    def __getstate__(self):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "fen": self.fen,
+            "comments": self.comments,
+            "evaluation": self.evaluation,
+            "children": self.children,
+            "main_variant": self.main_variant,
+            "file_header": self.file_header,
+        }
+
+    def __setstate__(self, state):
+        # also loads the repertoires pickled when Move still had a __dict__
+        self.name = sys.intern(state["name"])
+        self.parent = state["parent"]
+        self.fen = state["fen"]
+        self.comments = state["comments"]
+        self.evaluation = state["evaluation"]
+        self.children = state["children"]
+        self.main_variant = state["main_variant"]
+        self.file_header = state["file_header"]
+
     def __str__(self, com_fen=False, full_str=False) -> str:
         str_add = ""
         if com_fen:
@@ -46,27 +128,16 @@ class Move:
         self.children.append(child)
 
     def get_depth(self):
-        if self.parent is None:
-            return 0
-        return 1 + self.parent.get_depth()
+        return sum(1 for _ in ancestors(self.parent))
 
     def __eq__(self, __value) -> bool:
-        fen1 = self.fen[: self.fen.find(" ", self.fen.find(" ") + 1)]
-        fen2 = __value.fen[: __value.fen.find(" ", __value.fen.find(" ") + 1)]
-        # print("1:"+fen1)
-        # print("2:"+fen2)
-        if fen1 == fen2:
-            return True
-        return False
+        return self.fen_key == __value.fen_key
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(self.fen[: self.fen.find(" ", self.fen.find(" ") + 1)])
+        return hash(self.fen_key)
 
     def str_to_root(self) -> str:
-        if self.parent is None:
-            return self.name
-        string = self.name
-        return self.parent.str_to_root() + " " + string
+        return " ".join(reversed([move.name for move in ancestors(self)]))
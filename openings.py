@@ -0,0 +1,173 @@
+"""This module implements the index of the opening names of chess-openings"""
+
+import csv
+import os
+import pickle
+import re
+from pathlib import Path
+
+from move import position_key
+
+directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
+openings_path = directory_path / "chess-openings"
+opening_index_path = openings_path / "openings.pickle"
+
+# bump it when the content of the opening index changes
+OPENING_INDEX_VERSION = 2
+
+# a fen comment of pgn-extract with the spaces before it, the quotes are
+# optional
+FEN_COMMENT_RE = re.compile(
+    r'\s*\{\s*"?((?:[1-8pnbrqkPNBRQK]+/){7}[1-8pnbrqkPNBRQK]+ [wb] [^}"]*)"?\s*\}'
+)
+
+
+def tsv_signature() -> list:
+    """Get what identifies the current state of the chess-openings tsv files"""
+
+    signature: list = [OPENING_INDEX_VERSION]
+    for file in sorted(os.listdir(openings_path)):
+        if file.endswith(".tsv"):
+            stat = os.stat(openings_path / file)
+            signature.append((file, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def new_trie_node() -> dict:
+    return {"name": None, "children": {}, "first_name": None}
+
+
+def set_first_names(trie: dict):
+    """Give every node of the trie the name of the shallowest named opening
+    below it (itself included), that's the name of its continuation"""
+
+    nodes = [trie]
+    for node in nodes:
+        nodes += node["children"].values()
+    depths = {}
+    for node in reversed(nodes):
+        if node["name"] is not None:
+            node["first_name"] = node["name"]
+            depths[id(node)] = 0
+            continue
+        for child in node["children"].values():
+            if child["first_name"] is not None and (
+                id(node) not in depths or depths[id(child)] + 1 < depths[id(node)]
+            ):
+                node["first_name"] = child["first_name"]
+                depths[id(node)] = depths[id(child)] + 1
+
+
+def build_opening_index() -> dict:
+    """Read the chess-openings tsv files into an index of the opening names
+    by position key and a trie of the opening lines by uci move"""
+
+    names: dict[str, list[str]] = {}
+    trie = new_trie_node()
+    # position key -> first trie node reaching it, to follow the transpositions
+    positions: dict[str, dict] = {}
+    for file in sorted(os.listdir(openings_path)):
+        if file.endswith(".tsv"):
+            with open(openings_path / file, encoding="utf-8") as tab_file:
+                for line in csv.reader(tab_file, delimiter="\t"):
+                    if line[0] == "eco":
+                        continue
+                    fen_key = position_key(line[4])
+                    names.setdefault(fen_key, []).append(line[1])
+                    node = trie
+                    for uci in line[3].split(" "):
+                        node = node["children"].setdefault(uci, new_trie_node())
+                    if node["name"] is None:
+                        node["name"] = line[1]
+                    positions.setdefault(fen_key, node)
+    set_first_names(trie)
+    return {
+        "signature": tsv_signature(),
+        "names": names,
+        "trie": trie,
+        "positions": positions,
+    }
+
+
+def load_opening_index() -> dict:
+    """Load the opening index saved next to the tsv files, it is built again
+    only if the tsv files changed since"""
+
+    try:
+        with open(opening_index_path, "rb") as handle:
+            opening_index = pickle.load(handle)
+        if opening_index["signature"] == tsv_signature():
+            return opening_index
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    opening_index = build_opening_index()
+    with open(opening_index_path, "wb") as handle:
+        pickle.dump(opening_index, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    return opening_index
+
+
+def fill_opening_names(fen_pgn: str, names: dict[str, list[str]]) -> str:
+    """Add the opening names to the comments of a pgn-extract output (with
+    --fencomments) and remove its fen comments, the rest of the text is kept
+    as it is. Only the first move reaching an opening position in the text
+    gets its names"""
+
+    seen = set()
+    text = []
+    last_end = 0
+    for fen_comment in FEN_COMMENT_RE.finditer(fen_pgn):
+        before = fen_pgn[last_end : fen_comment.start()]
+        last_end = fen_comment.end()
+        fen_key = position_key(fen_comment.group(1))
+        if fen_key in seen:
+            # the fen of the final position added by -F is seen there too
+            text.append(before)
+            continue
+        seen.add(fen_key)
+        # a comment right before the fen one is the comment of the move
+        comment = re.search(r"\{([^}]*)\}$", before)
+        comment_text = "" if comment is None else comment.group(1).strip()
+        new_names = [
+            name for name in names.get(fen_key, []) if comment_text.find(name) == -1
+        ]
+        if len(new_names) == 0:
+            text.append(before)
+        elif comment is None:
+            text.append(before + " { " + " ".join(new_names) + " }")
+        else:
+            text.append(
+                before[: comment.start()]
+                + "{ "
+                + " ".join([comment_text] + new_names)
+                + " }"
+            )
+    text.append(fen_pgn[last_end:])
+    return "".join(text)
+
+
+def opening_at(
+    opening_index: dict, uci_moves: list[str], fen_key: str
+) -> tuple[str | None, list[tuple[str, str]]]:
+    """Get the opening name of a line and its named continuations as
+    (uci, name), in one walk of the trie along the line. When the line leaves
+    the trie, its position is looked up in case it transposes to an opening"""
+
+    node = opening_index["trie"]
+    name = None
+    for uci in uci_moves:
+        node = node["children"].get(uci)
+        if node is None:
+            break
+        if node["name"] is not None:
+            name = node["name"]
+    if fen_key in opening_index["names"]:
+        name = opening_index["names"][fen_key][0]
+    if node is None:
+        node = opening_index["positions"].get(fen_key)
+    if node is None:
+        return name, []
+    return name, [
+        (uci, child["first_name"])
+        for uci, child in node["children"].items()
+        if child["first_name"] is not None
+    ]
@@ -2,27 +2,23 @@
 It implements the main loop of the game and the CLI usage"""
 
 import os
-import re
-import subprocess
 import sys
 import textwrap
-import csv
 import locale
 from pathlib import Path
 
-from move import Move
+from deviations import find_deviations
+from openings import fill_opening_names, load_opening_index
+from repertoire_analysis import analyze_repertoire
+from transpositions import find_transpositions, write_transposition_report
 from window import Window
 from utils import (
-    build_fen_dict,
-    find_all_children,
+    extract_fen_pgn,
     french_chess,
-    is_not_a_bad_move,
     parse_config,
     read_and_build_tree,
-    remove_temp_pgn,
     repertoire_to_pgn,
     save_to_repertoire,
-    traversal_tree,
 )
 
 directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
@@ -35,91 +31,44 @@ def main(usecase):
     # find all the transpositions in the pgn files
     if usecase == "find_transpositions":
         fake_move = read_and_build_tree()
+        transpositions = find_transpositions(fake_move)
 
-        fens = []
-        moves = []
-        traversal_tree(fake_move, fens, moves)
+        report_path = directory_path / "transpositions.json"
+        if len(sys.argv) > 2:
+            report_path = Path(sys.argv[2])
+        write_transposition_report(transpositions, report_path)
 
-        transposition_dict = build_fen_dict(fens)
-        transposition_dict = list(transposition_dict.values())
-
-        true_duplicates = []
-        for d in transposition_dict:
-            nb_comments = 0
-            for idx in d:
-                if moves[idx].comments is not None:
-                    if moves[idx].comments.find("Transposition") > -1:
-                        nb_comments += 1
-                if moves[idx].parent.comments is not None:
-                    if moves[idx].parent.comments.find("Transposition") > -1:
-                        nb_comments += 1
-                if len(moves[idx].children) > 0:
-                    for move in moves[idx].children:
-                        if move.comments:
-                            if move.comments.find("Transposition") > -1:
-                                nb_comments += 1
-            if nb_comments < len(d) - 1:
-                true_duplicates.append(d)
-
-        print(true_duplicates)
-
-        for i, duplication in enumerate(reversed(true_duplicates)):
-            strings = []
-            for idx in duplication:
+        for i, duplication in enumerate(reversed(transpositions)):
+            print("duplication " + str(i) + ":\n")
+            for move in duplication:
                 if is_french:
-                    strings.append(
-                        "Transposition " + french_chess(moves[idx].str_to_root())
-                    )
+                    print("Transposition " + french_chess(move.str_to_root()))
                 else:
-                    strings.append("Transposition " + moves[idx].str_to_root())
-            # Remove mates and draw repetition moves
-            if strings[1].find(strings[0]) > -1 or strings[0][-1] == "#":
-                # print("REPETITION OR MATE")
-                # for s in strings:
-                #     print(s)
-                pass
-            elif len(strings) > 2 and strings[2].find(strings[0]) > -1:
-                pass
-            else:
-                print("duplication " + str(i) + ":\n")
-                for s in strings:
-                    print(s)
-                print("\n")
+                    print("Transposition " + move.str_to_root())
+            print("\n")
 
     # find all the deviationin the pgn files
     elif usecase == "find_deviations":
         if len(sys.argv) < 3:
             raise ValueError("You need to provide a color argument for find_deviations")
-        fake_move = read_and_build_tree()
-        fens = []
-        moves = []
-        traversal_tree(fake_move, fens, moves)
-
-        transposition_dict = build_fen_dict(fens)
-
         color = sys.argv[2]
         if color != "w" and color != "b":
             raise ValueError("The color argument is not b or w")
-        deviation = 1
-        for idx, fen in enumerate(fens):
-            all_children = find_all_children(transposition_dict, fen, moves, idx, True)
-            if (
-                len(fen) > 0
-                and len(list(filter(is_not_a_bad_move, all_children))) > 1
-                and fen[-1] == color
-            ):
-                print("-----deviation " + str(deviation) + "-----")
-                deviation = deviation + 1
-                for c in all_children:
-                    if is_french:
-                        print(
-                            french_chess(c.str_to_root())
-                            + (" " + c.comments if c.comments else "")
-                        )
-                    else:
-                        print(
-                            c.str_to_root() + (" " + c.comments if c.comments else "")
-                        )
+        min_depth = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        glyph = sys.argv[4] if len(sys.argv) > 4 else None
+        fake_move = read_and_build_tree()
+
+        deviations = find_deviations(fake_move, color, min_depth, glyph)
+        for deviation, (_, all_children) in enumerate(deviations):
+            print("-----deviation " + str(deviation + 1) + "-----")
+            for c in all_children:
+                if is_french:
+                    print(
+                        french_chess(c.str_to_root())
+                        + (" " + c.comments if c.comments else "")
+                    )
+                else:
+                    print(c.str_to_root() + (" " + c.comments if c.comments else ""))
 
     # split the pgn file exported from chessbase to one pgn per game
     elif usecase == "split_pgn":
@@ -165,7 +114,7 @@ def main(usecase):
         if len(sys.argv) < 3:
             raise ValueError(
                 """You need to provide a color argument for save_to_repertoire. 
-                The file will be then saved under \repertoire\\[w/b].repertoire.pickle"""
+                The file will be then saved under \repertoire\\[w/b].repertoire.bin"""
             )
         b_or_w = sys.argv[2]
         if b_or_w != "w" and b_or_w != "b":
@@ -175,64 +124,13 @@ def main(usecase):
 
     # Fill opening names into your pgns
     elif usecase == "fill_opening_names":
-        eco_codes = []
-        for file in os.listdir(directory_path / "chess-openings"):
-            if file.endswith(".tsv"):
-                full_path_file = directory_path / "chess-openings" / file
-                tab_file = open(full_path_file, encoding="utf-8")
-                tsv_file = csv.reader(tab_file, delimiter="\t")
-                for line in tsv_file:
-                    if line[0] != "eco":
-                        truncated_fen = line[4][0 : line[4].find(" ") + 2]
-                        eco_codes.append([line[1], truncated_fen])
-                tab_file.close()
-
+        names = load_opening_index()["names"]
         for file in os.listdir(directory_path / "pgns"):
-            fake_move = Move("", fen="w ")
-            full_path_file = directory_path / "pgns" / file
             if file.endswith(".pgn") and file != "game1.pgn":
-                subprocess.check_call(
-                    [
-                        directory_path / "pgn-extract.exe",
-                        "-F",
-                        "--fencomments",
-                        full_path_file,
-                        "-o",
-                        full_path_file + "_temp.pgn",
-                    ]
-                )
-
-                temp_pgn = open(full_path_file + "_temp.pgn", "r", encoding="utf-8")
-                fen_pgn = temp_pgn.read().replace("\n", " ")
-                temp_pgn.close()
-                fen_pgn = re.sub(
-                    r"\( \d+\.", lambda match: match.group(0).replace(" ", ""), fen_pgn
-                )
-                for opening in eco_codes:
-                    fen_idx = fen_pgn.find(opening[1])
-                    if fen_idx != -1:
-                        # if there is no comment already on the move
-                        if fen_pgn[fen_idx - 4] != "}":
-                            fen_pgn = (
-                                fen_pgn[: fen_idx - 3]
-                                + " { "
-                                + opening[0]
-                                + " }"
-                                + fen_pgn[fen_idx - 3 :]
-                            )
-                        else:
-                            fen_pgn = (
-                                fen_pgn[: fen_idx - 4]
-                                + opening[0]
-                                + " "
-                                + fen_pgn[fen_idx - 4 :]
-                            )
-                fen_pgn = re.sub(r"(?<=\{)[^}]*\/+[^}]*(?=\})", "", fen_pgn)
-                fen_pgn = fen_pgn.replace("{}", "").replace("]", "]\n")
-                write_pgn = open(full_path_file, "w", encoding="utf-8")
-                write_pgn.write(fen_pgn)
+                fen_pgn = extract_fen_pgn(str(directory_path / "pgns" / file))
+                write_pgn = open(directory_path / "pgns" / file, "w", encoding="utf-8")
+                write_pgn.write(fill_opening_names(fen_pgn, names))
                 write_pgn.close()
-        remove_temp_pgn()
     elif usecase == "export_repertoire":
         if len(sys.argv) < 3:
             raise ValueError(
@@ -244,6 +142,18 @@ def main(usecase):
             raise ValueError("The color argument is not b or w")
         repertoire_to_pgn(b_or_w)
         print("repertoire exported to pgns!")
+
+    # analyse all the positions of your repertoire with the engine
+    elif usecase == "analyze_repertoire":
+        if len(sys.argv) < 3:
+            raise ValueError(
+                "You need to provide a color argument for analyze_repertoire"
+            )
+        b_or_w = sys.argv[2]
+        if b_or_w != "w" and b_or_w != "b":
+            raise ValueError("The color argument is not b or w")
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        analyze_repertoire(b_or_w, workers)
     else:
         raise ValueError("The argument you passed to the program is not known")
 
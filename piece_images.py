@@ -0,0 +1,48 @@
+"""This module implements the cache of the piece images of the board"""
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+import PIL.Image
+import PIL.ImageTk
+
+directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
+
+
+class PieceImages:
+    """The piece images by square size. The png files are read once and the
+    images of the last sizes used are kept, so going back to a size (or
+    drawing again at the same size) doesn't read or resize anything"""
+
+    def __init__(self, max_sizes: int = 4):
+        self.max_sizes = max_sizes
+        # piece -> image read from the png file
+        self.sources: dict[str, PIL.Image.Image] = {}
+        # square size -> piece -> image, the least recently used first
+        self.images: OrderedDict[int, dict[str, PIL.ImageTk.PhotoImage]] = (
+            OrderedDict()
+        )
+
+    def load_sources(self):
+        for file in os.listdir(directory_path / "images" / "pieces"):
+            if file.endswith(".png"):
+                image_file = PIL.Image.open(directory_path / "images" / "pieces" / file)
+                image_file.load()
+                piece = file[1] if file[0] == "b" else file[1].upper()
+                self.sources[piece] = image_file
+
+    def get(self, size: int) -> dict[str, PIL.ImageTk.PhotoImage]:
+        """Get the images of the pieces for this square size"""
+
+        if size in self.images:
+            self.images.move_to_end(size)
+            return self.images[size]
+        if len(self.sources) == 0:
+            self.load_sources()
+        self.images[size] = {
+            piece: PIL.ImageTk.PhotoImage(image_file.resize((size, size)))
+            for piece, image_file in self.sources.items()
+        }
+        if len(self.images) > self.max_sizes:
+            self.images.popitem(last=False)
+        return self.images[size]
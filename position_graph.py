@@ -0,0 +1,121 @@
+"""This module implements the position graph used to navigate in a repertoire"""
+
+from typing import TYPE_CHECKING
+
+import chess
+
+from move import Move
+
+if TYPE_CHECKING:
+    from position_index import PositionIndex
+
+
+class Edge:
+    """A move from a position of the graph to the next one. The moves of the
+    edge are this move played in all the lines transposing to the position,
+    idx is the index of the move found at the next position"""
+
+    __slots__ = ("san", "uci", "idx", "moves")
+
+    def __init__(self, san: str, uci: str, idx: int, moves: list[Move]):
+        self.san = san
+        self.uci = uci
+        self.idx = idx
+        self.moves = moves
+
+    @property
+    def move(self) -> Move:
+        return self.moves[0]
+
+    @property
+    def main_variant(self) -> bool:
+        return self.move.main_variant
+
+    @property
+    def evaluation(self) -> list[str] | None:
+        return self.move.evaluation
+
+    @property
+    def comments(self) -> str | None:
+        return self.move.comments
+
+    def file_headers(self) -> list[str]:
+        """Get the headers of the files where this move is played"""
+
+        file_headers = []
+        for move in self.moves:
+            parent = move
+            while parent is not None and parent.file_header is None:
+                parent = parent.parent
+            if parent is not None and parent.file_header not in file_headers:
+                file_headers.append(parent.file_header)
+        return file_headers
+
+
+class PositionGraph:
+    """The repertoire seen as one node by position, the moves of all the
+    transposed lines being merged in the edges of the node. The edges of a
+    position are built the first time it is visited, so a lazily loaded
+    repertoire is only read where the board goes"""
+
+    def __init__(self, index: "PositionIndex"):
+        self.index = index
+        # position key -> edges from this position
+        self.nodes: dict[str, list[Edge]] = {}
+        # position key -> keys of the built positions with an edge to it
+        self.sources: dict[str, set[str]] = {}
+
+    def clear(self):
+        """Forget all the edges built"""
+
+        self.nodes = {}
+        self.sources = {}
+
+    def invalidate(self, move: Move):
+        """Forget the edges changed when the move is added to the repertoire
+        or removed from it: the ones from its position and from the position
+        of its parent, and the ones reaching its position (the move found
+        there can change)"""
+
+        self.nodes.pop(move.fen_key, None)
+        if move.parent is not None:
+            self.nodes.pop(move.parent.fen_key, None)
+        for fen_key in self.sources.pop(move.fen_key, set()):
+            self.nodes.pop(fen_key, None)
+
+    def edges(self, move: Move) -> list[Edge]:
+        """Get the edges from the position of the move"""
+
+        if move.fen_key in self.nodes:
+            return self.nodes[move.fen_key]
+        position_moves = self.index.moves_at(move.fen_key)
+        if len(position_moves) == 0:
+            position_moves = [move]
+        edges: dict[str, Edge] = {}
+        for position_move in position_moves:
+            if len(position_move.children) == 0:
+                continue
+            # the san is read from the fen of the parent of this very move, the
+            # castling and en passant rights of the transposed ones can differ
+            chess_board = (
+                chess.Board()
+                if position_move.name == ""
+                else chess.Board(position_move.fen)
+            )
+            for child in position_move.children:
+                if child.fen_key not in edges:
+                    san = child.name[child.name.find(" ") + 1 :]
+                    # the index of the move found at the next position, like
+                    # when the move is played on the board
+                    found_move = self.index.find(child.fen_key, child.name)
+                    edges[child.fen_key] = Edge(
+                        san,
+                        chess_board.parse_san(san).uci(),
+                        self.index.index_of(found_move),  # type: ignore
+                        [],
+                    )
+                edges[child.fen_key].moves.append(child)
+        for fen_key in edges:
+            self.sources.setdefault(fen_key, set()).add(move.fen_key)
+        self.nodes[move.fen_key] = list(edges.values())
+        return self.nodes[move.fen_key]
@@ -0,0 +1,173 @@
+"""This module implements the position index of a loaded repertoire"""
+
+from move import Move
+from position_graph import PositionGraph
+from repertoire_file import BinaryRepertoire, LazyMove
+from repertoire_store import SqliteRepertoire
+from traversal import preorder, tree_path
+
+
+class PositionIndex:
+    """Index the moves of a repertoire tree by position and by id so the
+    board lookups don't have to scan the whole tree. With a binary repertoire
+    the moves of the file are looked up in it and only the moves added or
+    removed since it was loaded are kept here. With a sqlite repertoire the
+    edits are written to the store and the lookups are indexed queries"""
+
+    def __init__(
+        self,
+        root: Move | None = None,
+        repertoire: BinaryRepertoire | SqliteRepertoire | None = None,
+    ):
+        self.repertoire = repertoire
+        # index -> moves added to the index (the file moves are in repertoire)
+        self.moves: dict[int, Move] = {}
+        # position key -> moves added to the index reaching this position
+        self.positions: dict[str, list[Move]] = {}
+        # id(move) -> index of the moves added to the index
+        self.ids: dict[int, int] = {}
+        # indices of the removed moves of the binary repertoire
+        self.removed: set[int] = set()
+        # the moves of a position are in tree order until a move is added,
+        # the sqlite repertoire keeps the moves added in the previous sessions
+        self.edited = isinstance(repertoire, SqliteRepertoire)
+        self.next_idx = 0 if repertoire is None else repertoire.node_count
+        self.graph = PositionGraph(self)
+        if root is not None and repertoire is None:
+            for move in preorder(root):
+                self.add(move)
+            # added in preorder, still in tree order
+            self.edited = False
+
+    def add(self, move: Move) -> int:
+        """Index a move newly added to the tree and return its index"""
+
+        if isinstance(self.repertoire, SqliteRepertoire):
+            idx = self.repertoire.insert(
+                move, self.index_of(move.parent)  # type: ignore
+            )
+        else:
+            idx = self.next_idx
+            self.next_idx += 1
+            self.positions.setdefault(move.fen_key, []).append(move)
+        self.moves[idx] = move
+        self.ids[id(move)] = idx
+        self.edited = True
+        self.graph.invalidate(move)
+        return idx
+
+    def remove(self, move: Move):
+        """Remove a move deleted from the tree and all its children"""
+
+        is_sqlite = isinstance(self.repertoire, SqliteRepertoire)
+        if is_sqlite:
+            self.repertoire.delete(self.index_of(move))  # type: ignore
+        to_remove = [move]
+        while len(to_remove) > 0:
+            removed_move = to_remove.pop()
+            to_remove += removed_move.children
+            self.graph.invalidate(removed_move)
+            if self.is_file_move(removed_move):
+                if not is_sqlite:
+                    self.removed.add(removed_move.node_idx)  # type: ignore
+                continue
+            idx = self.ids.pop(id(removed_move), None)
+            if idx is None:
+                continue
+            self.moves.pop(idx)
+            fen = removed_move.fen_key
+            if fen not in self.positions:
+                continue
+            # compare by identity, the moves are equal if they transpose
+            transposed_moves = [
+                m for m in self.positions[fen] if m is not removed_move
+            ]
+            if len(transposed_moves) > 0:
+                self.positions[fen] = transposed_moves
+            else:
+                self.positions.pop(fen)
+
+    def close(self):
+        """Close the repertoire file or store, to call before loading another
+        one"""
+
+        if self.repertoire is not None:
+            self.repertoire.close()
+
+    def detach(self, root: Move):
+        """Read the whole binary repertoire in memory and close its file, so
+        the file can be replaced (a mapped file can't be on Windows). The
+        indices of the moves don't change"""
+
+        repertoire = self.repertoire
+        self.positions = {}
+        for move in preorder(root):
+            if isinstance(move, LazyMove) and move.repertoire is repertoire:
+                self.moves[move.node_idx] = move
+                self.ids[id(move)] = move.node_idx
+            self.positions.setdefault(move.fen_key, []).append(move)
+        self.repertoire = None
+        self.removed = set()
+        self.edited = False
+        self.graph.clear()
+        if repertoire is not None:
+            repertoire.close()
+
+    def update(self, move: Move):
+        """Write the evaluation, comments and main variant flag of an edited
+        move to the sqlite repertoire, the other ones are saved as a whole"""
+
+        if isinstance(self.repertoire, SqliteRepertoire):
+            self.repertoire.update(self.index_of(move), move)
+
+    def is_file_move(self, move: Move) -> bool:
+        return isinstance(move, LazyMove) and move.repertoire is self.repertoire
+
+    def __contains__(self, fen: str) -> bool:
+        return len(self.moves_at(fen)) > 0
+
+    def index_of(self, move: Move) -> int:
+        """Get the index of this very move (not of a transposed one)"""
+
+        if self.is_file_move(move):
+            return move.node_idx  # type: ignore
+        return self.ids[id(move)]
+
+    def move_at(self, idx: int) -> Move:
+        """Get the move of this index"""
+
+        if idx in self.moves:
+            return self.moves[idx]
+        return self.repertoire.move(idx)  # type: ignore
+
+    def moves_at(self, fen: str) -> list[Move]:
+        """Get all the moves reaching the position of this truncated fen, in
+        tree order"""
+
+        moves: list[Move] = []
+        if self.repertoire is not None:
+            moves = [
+                self.move_at(idx)
+                for idx in self.repertoire.positions(fen)
+                if idx not in self.removed
+            ]
+        moves += self.positions.get(fen, [])
+        if self.edited and len(moves) > 1:
+            # the added moves are after the other ones, whatever their place
+            moves.sort(key=tree_path)
+        return moves
+
+    def find(self, fen: str, name: str | None = None) -> Move | None:
+        """Get the first move reaching this position, preferring the one
+        with the given name if some of them transpose"""
+
+        moves = self.moves_at(fen)
+        if len(moves) == 0:
+            return None
+        for move in moves:
+            if move.name == name:
+                return move
+        return moves[0]
+
+    def is_transposition(self, fen: str) -> bool:
+        return len(self.moves_at(fen)) > 1
@@ -0,0 +1,205 @@
+"""This module implements the analysis of all the positions of a repertoire
+by a pool of engines, the evaluations are saved in the evaluation cache"""
+
+import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import chess
+import chess.engine
+
+from engine import (
+    StableSearch,
+    analysis_limit,
+    analysis_multipv,
+    engine_name,
+    info_line,
+    open_evaluation_cache,
+    popen_engine,
+)
+from evaluation_cache import EvaluationCache
+from traversal import preorder
+from utils import load_repertoire, parse_config
+
+directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
+
+# the checkpoint is written every CHECKPOINT_EVERY analysed positions
+CHECKPOINT_EVERY = 20
+
+
+def repertoire_positions(b_or_w: str) -> list[chess.Board]:
+    """Get every position of the repertoire once, in the order of the tree"""
+
+    fake_move, repertoire = load_repertoire(b_or_w)
+    boards = {}
+    for move in preorder(fake_move):
+        board = chess.Board() if move.name == "" else chess.Board(move.fen)
+        boards.setdefault(board.epd(), board)
+    if repertoire is not None:
+        repertoire.close()
+    return list(boards.values())
+
+
+def load_checkpoint(path: Path) -> set[str]:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return set(json.load(handle))
+    except FileNotFoundError:
+        return set()
+
+
+def save_checkpoint(path: Path, done: set[str]):
+    """Write the analysed positions next to the checkpoint then move it, so a
+    stopped run never leaves a half written checkpoint"""
+
+    with open(str(path) + ".tmp", "w", encoding="utf-8") as handle:
+        json.dump(sorted(done), handle)
+    os.replace(str(path) + ".tmp", path)
+
+
+def analyse_position(
+    engines: "queue.Queue[chess.engine.SimpleEngine]",
+    cache: EvaluationCache,
+    board: chess.Board,
+    name: str,
+    limit: chess.engine.Limit,
+    multipv: int,
+    stable_iterations: int,
+):
+    """Analyse the position with a free engine of the pool and save its last
+    finished depth in the evaluation cache. The search stops at the limit or
+    when its best move and score are stable"""
+
+    current_depth = 0
+    best_move = None
+    best_score = None
+    lines: dict[int, str] = {}
+    # (depth, score, lines) of the last finished depth
+    finished: tuple[int, int | None, dict[int, str]] | None = None
+    stable_search = StableSearch(stable_iterations)
+    stable = False
+    engine = engines.get()
+    try:
+        with engine.analysis(board, limit, multipv=multipv) as analysis:
+            for info in analysis:
+                if info.get("score") is None or info.get("pv") is None:
+                    continue
+                depth = info.get("depth", 0)
+                if depth > current_depth:
+                    if current_depth > 0:
+                        finished = (current_depth, best_score, dict(lines))
+                        stable = stable_search.update(
+                            current_depth, best_move, best_score  # type: ignore
+                        )
+                        if stable:
+                            break
+                    current_depth = depth
+                lines[info.get("multipv", 1)] = info_line(board, info)
+                if info.get("multipv", 1) == 1:
+                    best_move = info["pv"][0]
+                    best_score = info["score"].white().score(mate_score=30000)
+    finally:
+        engines.put(engine)
+    if not stable and limit.depth is not None and current_depth >= limit.depth:
+        # the last depth is only finished when the search stopped at it
+        finished = (current_depth, best_score, lines)
+    if finished is None:
+        # no legal move (mate or stalemate), nothing to save
+        return
+    cache.put(board.epd(), name, multipv, *finished, stable)
+
+
+def searched(
+    cache: EvaluationCache,
+    board: chess.Board,
+    name: str,
+    multipv: int,
+    limit: chess.engine.Limit,
+) -> bool:
+    """True if the cached evaluation of the position is stable or reached the
+    depth limit"""
+
+    depth, stable = cache.status(board.epd(), name, multipv)
+    return stable or (limit.depth is not None and depth >= limit.depth)
+
+
+def analyze_repertoire(b_or_w: str, workers: int | None = None):
+    """Analyse every position of the repertoire with a pool of engines sharing
+    the configured threads and hash. The run can be stopped and started again,
+    the analysed positions are kept in a checkpoint until the end"""
+
+    config = parse_config()
+    limit = analysis_limit(config)
+    multipv = analysis_multipv(config)
+    stable_iterations = int(config.get("analysis_stable_iterations", 6))
+    if (
+        limit.depth is None
+        and limit.nodes is None
+        and limit.time is None
+        and stable_iterations == 0
+    ):
+        raise ValueError(
+            "The analysis of the repertoire needs a depth, nodes, movetime or "
+            "stable iterations limit in the configuration"
+        )
+    threads = int(config["stockfish_threads"])
+    hash_size = int(config["stockfish_hash_size"])
+    if workers is None:
+        workers = threads
+    checkpoint_path = directory_path / "cache" / (b_or_w + ".analysis.checkpoint")
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    done = load_checkpoint(checkpoint_path)
+    boards = [
+        board for board in repertoire_positions(b_or_w) if board.epd() not in done
+    ]
+    print(str(len(done)) + " positions already analysed in the last run")
+
+    pool = [
+        popen_engine(max(1, threads // workers), max(1, hash_size // workers))
+        for _ in range(workers)
+    ]
+    # the engines of the pool are the same one
+    name = engine_name(pool[0])
+    # the free engines of the pool
+    engines: "queue.Queue[chess.engine.SimpleEngine]" = queue.Queue()
+    for engine in pool:
+        engines.put(engine)
+    cache = open_evaluation_cache()
+    boards = [
+        board
+        for board in boards
+        if not searched(cache, board, name, multipv, limit)
+    ]
+    print(str(len(boards)) + " positions to analyse")
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(
+                analyse_position,
+                engines,
+                cache,
+                board,
+                name,
+                limit,
+                multipv,
+                stable_iterations,
+            ): board
+            for board in boards
+        }
+        for i, future in enumerate(as_completed(futures)):
+            future.result()
+            done.add(futures[future].epd())
+            if (i + 1) % CHECKPOINT_EVERY == 0:
+                save_checkpoint(checkpoint_path, done)
+                print(str(i + 1) + "/" + str(len(boards)) + " positions analysed")
+    finally:
+        # on an interruption, only wait for the positions being analysed
+        executor.shutdown(cancel_futures=True)
+        save_checkpoint(checkpoint_path, done)
+        for engine in pool:
+            engine.quit()
+        cache.close()
+    # everything is analysed, the next run starts again from the cache
+    os.remove(checkpoint_path)
+    print("repertoire analysed!")
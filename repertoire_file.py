@@ -0,0 +1,303 @@
+"""This module implements the binary repertoire file, read lazily with mmap
+
+Layout (little endian):
+- header: magic, version, node, string and position counts, sections offsets
+- nodes: one fixed-size record per move in preorder (root first) with the
+  string ids of its name, fen, comments, evaluation and file header, its
+  parent index, the slice of its children in the children section and flags
+- children: the node indices of the children of every node
+- strings: the offsets of every string of the pool, then the utf-8 pool
+- positions: the position keys sorted by bytes with the slice of their nodes
+  in the position nodes section, then the position nodes
+"""
+
+import copyreg
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from move import Move
+from traversal import preorder
+
+MAGIC = b"CRPB"
+FORMAT_VERSION = 1
+NONE_ID = 0xFFFFFFFF
+
+HEADER = struct.Struct("<4sIIII6Q")
+NODE = struct.Struct("<8IB3x")
+POSITION = struct.Struct("<III")
+OFFSET = struct.Struct("<Q")
+INDEX = struct.Struct("<I")
+
+MAIN_VARIANT_FLAG = 1
+
+_children_slot = Move.children
+
+
+class LazyMove(Move):
+    """A move of a binary or sqlite repertoire, its children are only read
+    from the file the first time they are needed"""
+
+    __slots__ = ("repertoire", "node_idx", "children_loaded")
+
+    def __init__(
+        self,
+        repertoire: "BinaryRepertoire | SqliteRepertoire",
+        node_idx: int,
+        name,
+        fen,
+        comments=None,
+        parent=None,
+        evaluation=None,
+        main_variant=True,
+        file_header=None,
+    ):
+        super().__init__(
+            name,
+            fen,
+            comments=comments,
+            parent=parent,
+            evaluation=evaluation,
+            main_variant=main_variant,
+            file_header=file_header,
+        )
+        self.repertoire = repertoire
+        self.node_idx: int = node_idx
+        self.children_loaded: bool = False
+
+    @property
+    def children(self) -> list[Move]:  # type: ignore
+        if not self.children_loaded:
+            self.children_loaded = True
+            _children_slot.__set__(
+                self,
+                [
+                    self.repertoire.move(child_idx)
+                    for child_idx in self.repertoire.children_indices(self.node_idx)
+                ],
+            )
+        return _children_slot.__get__(self, Move)
+
+    @children.setter
+    def children(self, children: list[Move]):
+        _children_slot.__set__(self, children)
+        self.children_loaded = True
+
+    def __reduce__(self):
+        # pickled as a plain Move, the file may not be there when unpickling
+        return (copyreg.__newobj__, (Move,), self.__getstate__())
+
+
+class BinaryRepertoire:
+    """A binary repertoire file opened with mmap, the moves are materialized
+    when they are visited"""
+
+    def __init__(self, path: Path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.node_count,
+            self.string_count,
+            self.position_count,
+            self.nodes_offset,
+            self.children_offset,
+            self.string_offsets_offset,
+            self.strings_offset,
+            self.positions_offset,
+            self.position_nodes_offset,
+        ) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("This file is not a binary repertoire: " + str(path))
+        self.materialized: dict[int, LazyMove] = {}
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def string_bytes(self, string_id: int) -> bytes:
+        start, end = struct.unpack_from(
+            "<2Q", self.data, self.string_offsets_offset + OFFSET.size * string_id
+        )
+        return self.data[self.strings_offset + start : self.strings_offset + end]
+
+    def string(self, string_id: int) -> str | None:
+        if string_id == NONE_ID:
+            return None
+        return self.string_bytes(string_id).decode("utf-8")
+
+    def children_indices(self, node_idx: int) -> tuple[int, ...]:
+        record = NODE.unpack_from(self.data, self.nodes_offset + NODE.size * node_idx)
+        first_child, child_count = record[6], record[7]
+        return struct.unpack_from(
+            "<" + str(child_count) + "I",
+            self.data,
+            self.children_offset + INDEX.size * first_child,
+        )
+
+    def move(self, node_idx: int) -> LazyMove:
+        """Get the move of this node, materializing its missing parents first"""
+
+        if node_idx in self.materialized:
+            return self.materialized[node_idx]
+        to_materialize = []
+        parent_idx = node_idx
+        while parent_idx != NONE_ID and parent_idx not in self.materialized:
+            record = NODE.unpack_from(
+                self.data, self.nodes_offset + NODE.size * parent_idx
+            )
+            to_materialize.append((parent_idx, record))
+            parent_idx = record[5]
+        for idx, record in reversed(to_materialize):
+            parent_idx = record[5]
+            self.materialized[idx] = LazyMove(
+                self,
+                idx,
+                parent=None if parent_idx == NONE_ID else self.materialized[parent_idx],
+                **self.record_fields(record),
+            )
+        return self.materialized[node_idx]
+
+    def record_fields(self, record: tuple) -> dict:
+        """Decode the Move arguments of a node record, without its parent"""
+
+        name, fen, comments, evaluation, file_header, _, _, _, flags = record
+        evaluation_str = self.string(evaluation)
+        return {
+            "name": self.string(name),
+            "fen": self.string(fen),
+            "comments": self.string(comments),
+            "evaluation": (
+                None
+                if evaluation_str is None
+                else [e for e in evaluation_str.split(" ") if e != ""]
+            ),
+            "main_variant": bool(flags & MAIN_VARIANT_FLAG),
+            "file_header": self.string(file_header),
+        }
+
+    def read_tree(self) -> Move:
+        """Read the whole tree in plain moves that don't need the file. The
+        nodes are in preorder so every parent is built before its children,
+        one loop over the nodes without any recursion"""
+
+        moves: list[Move] = []
+        for idx in range(self.node_count):
+            record = NODE.unpack_from(self.data, self.nodes_offset + NODE.size * idx)
+            parent = None if record[5] == NONE_ID else moves[record[5]]
+            move = Move(parent=parent, **self.record_fields(record))
+            if parent is not None:
+                parent.children.append(move)
+            moves.append(move)
+        return moves[0]
+
+    def root(self) -> LazyMove:
+        return self.move(0)
+
+    def positions(self, fen_key: str) -> tuple[int, ...]:
+        """Get the indices of the nodes reaching this position, by a binary
+        search on the sorted position keys"""
+
+        key = fen_key.encode("utf-8")
+        low = 0
+        high = self.position_count
+        while low < high:
+            middle = (low + high) // 2
+            key_id, first, count = POSITION.unpack_from(
+                self.data, self.positions_offset + POSITION.size * middle
+            )
+            middle_key = self.string_bytes(key_id)
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return struct.unpack_from(
+                    "<" + str(count) + "I",
+                    self.data,
+                    self.position_nodes_offset + INDEX.size * first,
+                )
+        return ()
+
+
+def write_binary_repertoire(path: Path, root: Move):
+    """Write the tree of root into a binary repertoire file. The file is
+    written next to it then moved, so a stopped save never leaves a half
+    written repertoire. The tree must not be read from the file it replaces:
+    a mapped file can't be replaced on Windows, see PositionIndex.detach"""
+
+    moves = list(preorder(root))
+    ids = {id(move): idx for idx, move in enumerate(moves)}
+    strings: dict[str, int] = {}
+
+    def string_id(string: str | None) -> int:
+        if string is None:
+            return NONE_ID
+        if string not in strings:
+            strings[string] = len(strings)
+        return strings[string]
+
+    nodes = bytearray()
+    children = []
+    positions: dict[str, list[int]] = {}
+    for idx, move in enumerate(moves):
+        nodes += NODE.pack(
+            string_id(move.name),
+            string_id(move.fen),
+            string_id(move.comments),
+            string_id(None if move.evaluation is None else " ".join(move.evaluation)),
+            string_id(move.file_header),
+            NONE_ID if move.parent is None else ids[id(move.parent)],
+            len(children),
+            len(move.children),
+            MAIN_VARIANT_FLAG if move.main_variant else 0,
+        )
+        children += [ids[id(child)] for child in move.children]
+        positions.setdefault(move.fen_key, []).append(idx)
+
+    sorted_keys = sorted(positions, key=lambda k: k.encode("utf-8"))
+    position_table = bytearray()
+    position_nodes = []
+    for fen_key in sorted_keys:
+        position_table += POSITION.pack(
+            string_id(fen_key), len(position_nodes), len(positions[fen_key])
+        )
+        position_nodes += positions[fen_key]
+
+    pool = bytearray()
+    string_offsets = [0]
+    for string in strings:
+        pool += string.encode("utf-8")
+        string_offsets.append(len(pool))
+
+    sections = [
+        nodes,
+        struct.pack("<" + str(len(children)) + "I", *children),
+        struct.pack("<" + str(len(string_offsets)) + "Q", *string_offsets),
+        pool,
+        position_table,
+        struct.pack("<" + str(len(position_nodes)) + "I", *position_nodes),
+    ]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+
+    temp_path = str(path) + ".tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(
+            HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                len(moves),
+                len(strings),
+                len(sorted_keys),
+                *offsets,
+            )
+        )
+        for section in sections:
+            handle.write(section)
+    os.replace(temp_path, path)
@@ -0,0 +1,197 @@
+"""This module implements the sqlite repertoire store, edited move by move"""
+
+import sqlite3
+from pathlib import Path
+
+from move import Move
+from repertoire_file import LazyMove
+from traversal import preorder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    child_order INTEGER NOT NULL,
+    fen_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    fen TEXT NOT NULL,
+    comments TEXT,
+    evaluation TEXT,
+    main_variant INTEGER NOT NULL,
+    file_header TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_fen_key ON nodes (fen_key);
+CREATE INDEX IF NOT EXISTS nodes_parent_id ON nodes (parent_id, child_order);
+"""
+
+
+def evaluation_to_str(evaluation: list[str] | None) -> str | None:
+    return None if evaluation is None else " ".join(evaluation)
+
+
+def str_to_evaluation(evaluation: str | None) -> list[str] | None:
+    if evaluation is None:
+        return None
+    return [e for e in evaluation.split(" ") if e != ""]
+
+
+class SqliteRepertoire:
+    """A repertoire stored in a sqlite database indexed by position and by
+    parent, the moves are materialized when they are visited and every edit
+    is a single row write, committed when the repertoire is saved"""
+
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.materialized: dict[int, Move] = {}
+
+    def close(self):
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+
+    @property
+    def node_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def save_tree(self, root: Move):
+        """Replace the content of the store by the tree of root, the ids are
+        given in preorder so the root is 0"""
+
+        moves = list(preorder(root))
+        ids = {id(move): idx for idx, move in enumerate(moves)}
+        child_orders = {id(root): 0}
+        for move in moves:
+            for child_order, child in enumerate(move.children):
+                child_orders[id(child)] = child_order
+        rows = []
+        for idx, move in enumerate(moves):
+            rows.append(
+                (
+                    idx,
+                    None if move.parent is None else ids[id(move.parent)],
+                    child_orders[id(move)],
+                    move.fen_key,
+                    move.name,
+                    move.fen,
+                    move.comments,
+                    evaluation_to_str(move.evaluation),
+                    int(move.main_variant),
+                    move.file_header,
+                )
+            )
+        self.connection.execute("DELETE FROM nodes")
+        self.connection.executemany(
+            "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.connection.commit()
+        self.materialized = {}
+
+    def move(self, node_idx: int) -> Move:
+        """Get the move of this node, materializing its missing parents first"""
+
+        if node_idx in self.materialized:
+            return self.materialized[node_idx]
+        to_materialize = []
+        parent_idx = node_idx
+        while parent_idx is not None and parent_idx not in self.materialized:
+            row = self.connection.execute(
+                """SELECT parent_id, name, fen, comments, evaluation, main_variant,
+                file_header FROM nodes WHERE id = ?""",
+                (parent_idx,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(
+                    "No move with this id in the repertoire: " + str(parent_idx)
+                )
+            to_materialize.append((parent_idx, row))
+            parent_idx = row[0]
+        for idx, row in reversed(to_materialize):
+            parent_idx, name, fen, comments, evaluation, main_variant, file_header = (
+                row
+            )
+            self.materialized[idx] = LazyMove(
+                self,
+                idx,
+                name=name,
+                fen=fen,
+                comments=comments,
+                parent=None if parent_idx is None else self.materialized[parent_idx],
+                evaluation=str_to_evaluation(evaluation),
+                main_variant=bool(main_variant),
+                file_header=file_header,
+            )
+        return self.materialized[node_idx]
+
+    def root(self) -> Move:
+        return self.move(0)
+
+    def children_indices(self, node_idx: int) -> list[int]:
+        rows = self.connection.execute(
+            "SELECT id FROM nodes WHERE parent_id = ? ORDER BY child_order",
+            (node_idx,),
+        )
+        return [row[0] for row in rows]
+
+    def positions(self, fen_key: str) -> list[int]:
+        rows = self.connection.execute(
+            "SELECT id FROM nodes WHERE fen_key = ? ORDER BY id", (fen_key,)
+        )
+        return [row[0] for row in rows]
+
+    def insert(self, move: Move, parent_idx: int) -> int:
+        """Insert a move added under the move parent_idx and return its id"""
+
+        cursor = self.connection.execute(
+            """INSERT INTO nodes (parent_id, child_order, fen_key, name, fen,
+            comments, evaluation, main_variant, file_header)
+            SELECT ?, COALESCE(MAX(child_order) + 1, 0), ?, ?, ?, ?, ?, ?, ?
+            FROM nodes WHERE parent_id = ?""",
+            (
+                parent_idx,
+                move.fen_key,
+                move.name,
+                move.fen,
+                move.comments,
+                evaluation_to_str(move.evaluation),
+                int(move.main_variant),
+                move.file_header,
+                parent_idx,
+            ),
+        )
+        idx: int = cursor.lastrowid  # type: ignore
+        self.materialized[idx] = move
+        return idx
+
+    def update(self, node_idx: int, move: Move):
+        """Write the annotations of a move edited in place"""
+
+        self.connection.execute(
+            """UPDATE nodes SET comments = ?, evaluation = ?, main_variant = ?,
+            file_header = ? WHERE id = ?""",
+            (
+                move.comments,
+                evaluation_to_str(move.evaluation),
+                int(move.main_variant),
+                move.file_header,
+                node_idx,
+            ),
+        )
+
+    def delete(self, node_idx: int):
+        """Delete a move and all its children"""
+
+        rows = self.connection.execute(
+            """WITH RECURSIVE subtree(id) AS (
+                SELECT ?
+                UNION ALL
+                SELECT nodes.id FROM nodes
+                JOIN subtree ON nodes.parent_id = subtree.id
+            )
+            SELECT id FROM subtree""",
+            (node_idx,),
+        ).fetchall()
+        self.connection.executemany("DELETE FROM nodes WHERE id = ?", rows)
+        for row in rows:
+            self.materialized.pop(row[0], None)
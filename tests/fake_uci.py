@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""A tiny fake uci engine for the tests. It searches one depth every few
+milliseconds and gives its first legal moves as the lines, with the same
+scores at every depth"""
+
+import sys
+import threading
+import time
+
+import chess
+
+MAX_DEPTH = 99
+
+
+def out(line: str):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def search(board: chess.Board, multipv: int, depth: int, movetime: float | None):
+    moves = list(board.legal_moves)[:multipv]
+    if len(moves) == 0:
+        out("info depth 0 score mate 0")
+        out("bestmove (none)")
+        return
+    start = time.monotonic()
+    current_depth = 0
+    while not stop.is_set() and current_depth < depth:
+        if movetime is not None and time.monotonic() - start >= movetime:
+            break
+        current_depth += 1
+        for i, move in enumerate(moves):
+            out(
+                "info depth "
+                + str(current_depth)
+                + " multipv "
+                + str(i + 1)
+                + " score cp "
+                + str(20 - i)
+                + " nodes "
+                + str(1000 * current_depth)
+                + " pv "
+                + move.uci()
+            )
+        time.sleep(0.002)
+    out("bestmove " + moves[0].uci())
+
+
+stop = threading.Event()
+worker: threading.Thread | None = None
+board = chess.Board()
+multipv = 1
+for command in sys.stdin:
+    tokens = command.split()
+    if len(tokens) == 0:
+        continue
+    if tokens[0] == "uci":
+        out("id name fake")
+        out("option name Hash type spin default 16 min 1 max 33554432")
+        out("option name Threads type spin default 1 min 1 max 1024")
+        out("option name MultiPV type spin default 1 min 1 max 500")
+        out("uciok")
+    elif tokens[0] == "isready":
+        out("readyok")
+    elif tokens[0] == "setoption" and tokens[2] == "MultiPV":
+        multipv = int(tokens[4])
+    elif tokens[0] == "position":
+        if tokens[1] == "startpos":
+            board = chess.Board()
+            rest = tokens[2:]
+        else:
+            board = chess.Board(" ".join(tokens[2:8]))
+            rest = tokens[8:]
+        for uci in rest[1:]:
+            board.push_uci(uci)
+    elif tokens[0] == "go":
+        depth = int(tokens[tokens.index("depth") + 1]) if "depth" in tokens else None
+        movetime = (
+            int(tokens[tokens.index("movetime") + 1]) / 1000
+            if "movetime" in tokens
+            else None
+        )
+        stop.clear()
+        worker = threading.Thread(
+            target=search, args=(board.copy(), multipv, depth or MAX_DEPTH, movetime)
+        )
+        worker.start()
+    elif tokens[0] == "stop":
+        stop.set()
+        if worker is not None:
+            worker.join()
+    elif tokens[0] == "quit":
+        stop.set()
+        break
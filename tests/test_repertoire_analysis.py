@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import sys
+
+import chess
+import pytest
+
+import engine
+import repertoire_analysis
+import utils
+from move import Move
+from repertoire_file import write_binary_repertoire
+
+FAKE_ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_uci.py")
+
+
+def build_repertoire(path):
+    """1. e4 e5 2. Nf3 Nc6 and 1. d4 d5, 7 positions with the start one"""
+
+    root = Move("", fen="w ")
+    for line in (["e4", "e5", "Nf3", "Nc6"], ["d4", "d5"]):
+        board = chess.Board()
+        parent = root
+        for san in line:
+            board.push_san(san)
+            move = Move(san, fen=board.fen(), parent=parent)
+            parent.add_child(move)
+            parent = move
+    path.mkdir()
+    write_binary_repertoire(path / "w.repertoire.bin", root)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """A project directory with a small repertoire, the fake engine and no
+    early stop, so every position is searched up to depth 5"""
+
+    if sys.platform == "win32":
+        pytest.skip("the fake engine is started as a script")
+    (tmp_path / "configuration.txt").write_text(
+        "\n".join(
+            [
+                "stockfish_path=" + FAKE_ENGINE,
+                "stockfish_threads=2",
+                "stockfish_hash_size=16",
+                "evaluation_cache_size=1000",
+                "analysis_depth=5",
+                "analysis_multipv=2",
+                "analysis_stable_iterations=0",
+            ]
+        ),
+        encoding="utf-8",
+    )
+    build_repertoire(tmp_path / "repertoire")
+    monkeypatch.setattr(utils, "directory_path", tmp_path)
+    monkeypatch.setattr(repertoire_analysis, "directory_path", tmp_path)
+    monkeypatch.setattr(
+        engine, "evaluation_cache_path", tmp_path / "cache" / "evaluations.sqlite"
+    )
+    return tmp_path
+
+
+def cached_rows(project) -> list[tuple]:
+    connection = sqlite3.connect(project / "cache" / "evaluations.sqlite")
+    rows = connection.execute(
+        "SELECT position, engine, multipv, depth, lines FROM evaluations"
+    ).fetchall()
+    connection.close()
+    return rows
+
+
+def test_analyze_repertoire(project):
+    repertoire_analysis.analyze_repertoire("w", 2)
+
+    rows = cached_rows(project)
+    assert len(rows) == 7
+    for _, name, multipv, depth, lines in rows:
+        assert (name, multipv, depth) == ("fake", 2, 5)
+        assert sorted(json.loads(lines)) == ["1", "2"]
+    assert not (project / "cache" / "w.analysis.checkpoint").exists()
+
+
+def test_resume_after_interruption(project, monkeypatch):
+    analysed = []
+    analyse_position = repertoire_analysis.analyse_position
+
+    def interrupted(engines, cache, board, *args):
+        if len(analysed) == 3:
+            raise KeyboardInterrupt
+        analyse_position(engines, cache, board, *args)
+        analysed.append(board.epd())
+
+    monkeypatch.setattr(repertoire_analysis, "analyse_position", interrupted)
+    monkeypatch.setattr(repertoire_analysis, "CHECKPOINT_EVERY", 1)
+    with pytest.raises(KeyboardInterrupt):
+        repertoire_analysis.analyze_repertoire("w", 1)
+
+    checkpoint_path = project / "cache" / "w.analysis.checkpoint"
+    with open(checkpoint_path, encoding="utf-8") as handle:
+        assert sorted(json.load(handle)) == sorted(analysed)
+    assert len(cached_rows(project)) == 3
+
+    first_run = list(analysed)
+    resumed = []
+    monkeypatch.setattr(
+        repertoire_analysis,
+        "analyse_position",
+        lambda engines, cache, board, *args: (
+            resumed.append(board.epd()),
+            analyse_position(engines, cache, board, *args),
+        ),
+    )
+    repertoire_analysis.analyze_repertoire("w", 1)
+
+    assert len(resumed) == 4
+    assert set(resumed).isdisjoint(first_run)
+    assert len(cached_rows(project)) == 7
+    assert not checkpoint_path.exists()
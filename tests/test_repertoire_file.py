@@ -0,0 +1,80 @@
+import chess
+
+from move import Move
+from position_index import PositionIndex
+from repertoire_file import BinaryRepertoire, write_binary_repertoire
+from traversal import preorder
+
+
+def build_tree() -> Move:
+    """1. e4 e5 2. Nf3 (2. Nc3) and 1. d4 with a comment and a NAG"""
+
+    root = Move("", fen="w ")
+    for line in (["e4", "e5", "Nf3"], ["e4", "e5", "Nc3"], ["d4"]):
+        board = chess.Board()
+        parent = root
+        for san in line:
+            name = (
+                str(board.fullmove_number) + ". " + san
+                if board.turn == chess.WHITE
+                else san
+            )
+            board.push_san(san)
+            move = next((c for c in parent.children if c.name == name), None)
+            if move is None:
+                move = Move(
+                    name,
+                    fen=board.fen(),
+                    parent=parent,
+                    main_variant=len(parent.children) == 0,
+                )
+                parent.add_child(move)
+            parent = move
+    root.children[1].comments = "Queen pawn"
+    root.children[1].evaluation = ["$1"]
+    return root
+
+
+def dump(root: Move) -> list[tuple]:
+    return [
+        (move.name, move.fen, move.comments, move.evaluation, move.main_variant)
+        for move in preorder(root)
+    ]
+
+
+def test_round_trip(tmp_path):
+    root = build_tree()
+    path = tmp_path / "w.repertoire.bin"
+    write_binary_repertoire(path, root)
+    repertoire = BinaryRepertoire(path)
+    assert dump(repertoire.root()) == dump(root)
+    nf3 = root.children[0].children[0].children[0]
+    assert [
+        repertoire.move(idx).name for idx in repertoire.positions(nf3.fen_key)
+    ] == ["2. Nf3"]
+    repertoire.close()
+
+
+def test_save_over_the_loaded_file(tmp_path):
+    path = tmp_path / "w.repertoire.bin"
+    write_binary_repertoire(path, build_tree())
+    repertoire = BinaryRepertoire(path)
+    root = repertoire.root()
+    index = PositionIndex(root, repertoire)
+    e5 = root.children[0].children[0]
+    board = chess.Board(e5.fen)
+    board.push_san("Bc4")
+    bc4 = Move("2. Bc4", fen=board.fen(), parent=e5, main_variant=False)
+    e5.add_child(bc4)
+    bc4_idx = index.add(bc4)
+    e5_idx = index.index_of(e5)
+
+    index.detach(root)
+    assert repertoire.data.closed
+    assert index.index_of(e5) == e5_idx
+    assert index.move_at(bc4_idx) is bc4
+    write_binary_repertoire(path, root)
+
+    saved = BinaryRepertoire(path)
+    assert dump(saved.root()) == dump(root)
+    saved.close()
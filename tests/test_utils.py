@@ -0,0 +1,165 @@
+import chess
+import pytest
+
+import utils
+from move import Move
+from traversal import preorder
+
+HEADER = '[Event "?"]\n[White "Deep"]\n[Black "?"]'
+
+
+def fen_pgn(sans: list[str]) -> str:
+    """The pgn-extract -F --fencomments output of one line"""
+
+    board = chess.Board()
+    tokens = []
+    for san in sans:
+        if board.turn == chess.WHITE:
+            tokens.append(str(board.fullmove_number) + ".")
+        tokens.append(san)
+        board.push_san(san)
+        tokens.append("{ " + board.fen() + " }")
+    tokens.append("{ " + board.fen() + " }")
+    return HEADER + "\n\n" + " ".join(tokens) + " *\n"
+
+
+# 220 plies of knights going back and forth
+DEEP_LINE = ["Nf3", "Nf6", "Ng1", "Ng8"] * 55
+
+
+@pytest.fixture
+def pgns(tmp_path, monkeypatch):
+    """A pgns folder whose pgn-extract outputs are written by the test"""
+
+    outputs = {}
+    (tmp_path / "pgns").mkdir()
+    monkeypatch.setattr(utils, "directory_path", tmp_path)
+    monkeypatch.setattr(utils, "pgn_extract_version", lambda: "test")
+    monkeypatch.setattr(
+        utils, "extract_fen_pgn", lambda path: outputs[path.split("/")[-1]]
+    )
+
+    def add(file: str, sans: list[str]):
+        outputs[file] = fen_pgn(sans)
+        # the pgn itself, only its headers and its content hash are read
+        (tmp_path / "pgns" / file).write_text(outputs[file], encoding="utf-8")
+
+    return add
+
+
+def depth(fake_move) -> int:
+    return max(move.get_depth() for move in preorder(fake_move))
+
+
+def test_read_and_build_tree_deep_line(pgns, tmp_path):
+    pgns("deep.pgn", DEEP_LINE)
+
+    fake_move = utils.read_and_build_tree(workers=1)
+    assert depth(fake_move) == 220
+    assert len(list((tmp_path / "cache" / "pgns").iterdir())) == 1
+
+    # the second time from the cache
+    cached = utils.read_and_build_tree(workers=1)
+    assert [(m.name, m.fen, m.file_header) for m in preorder(cached)] == [
+        (m.name, m.fen, m.file_header) for m in preorder(fake_move)
+    ]
+
+
+def test_read_and_build_tree_workers(pgns):
+    pgns("(1) deep.pgn", DEEP_LINE)
+    pgns("(2) short.pgn", ["d4", "d5", "c4"])
+
+    fake_move = utils.read_and_build_tree(workers=2)
+    assert [child.name for child in fake_move.children] == ["1. Nf3", "1. d4"]
+    assert depth(fake_move) == 220
+    assert fake_move.children[1].file_header == HEADER
+
+
+def fen(*sans: str) -> str:
+    board = chess.Board()
+    for san in sans:
+        board.push_san(san)
+    return board.fen()
+
+
+def parse(pgn: str, file_header: str | None = HEADER) -> Move:
+    return utils.construct_tree(Move("", fen="w "), pgn, file_header)
+
+
+def test_construct_tree_variations():
+    root = parse(
+        "1. e4 { " + fen("e4") + " } e5 { " + fen("e4", "e5") + " } "
+        "( 1... c5 { " + fen("e4", "c5") + " } "
+        "2. Nf3 { " + fen("e4", "c5", "Nf3") + " } "
+        "( 2. Nc3 { " + fen("e4", "c5", "Nc3") + " } ) "
+        "2... d6 { " + fen("e4", "c5", "Nf3", "d6") + " } ) "
+        "2. Nf3 { " + fen("e4", "e5", "Nf3") + " } *"
+    )
+
+    (e4,) = root.children
+    assert e4.file_header == HEADER
+    assert [move.name for move in e4.children] == ["e5", "1... c5"]
+    e5, c5 = e4.children
+    assert [move.main_variant for move in e4.children] == [True, False]
+    assert [move.name for move in e5.children] == ["2. Nf3"]
+    assert [move.name for move in c5.children] == ["2. Nf3", "2. Nc3"]
+    assert [move.name for move in c5.children[0].children] == ["2... d6"]
+    assert c5.children[1].children == []
+    assert c5.children[0].children[0].fen == fen("e4", "c5", "Nf3", "d6")
+    assert c5.children[1].parent is c5
+
+
+def test_construct_tree_nags_and_comments():
+    root = parse(
+        "{ The main line } 1. e4 $1 $14 { Best by test } { " + fen("e4") + " } "
+        "e5 $2 { " + fen("e4", "e5") + " } "
+        "( { Sharper } 1... c5 $1 { " + fen("e4", "c5") + " } ) *"
+    )
+
+    e4 = root.children[0]
+    assert e4.evaluation == ["$1", "$14"]
+    assert e4.comments == "The main line Best by test"
+    assert e4.fen == fen("e4")
+    e5, c5 = e4.children
+    assert (e5.evaluation, e5.comments, e5.fen) == (["$2"], None, fen("e4", "e5"))
+    assert (c5.evaluation, c5.comments, c5.fen) == (
+        ["$1"],
+        "Sharper",
+        fen("e4", "c5"),
+    )
+
+
+def test_construct_tree_several_games():
+    second_header = '[Event "?"]\n[White "Second"]\n[Black "?"]'
+    root = parse(
+        HEADER + "\n\n1. e4 { " + fen("e4") + " } *\n\n"
+        + second_header + "\n\n1. d4 { " + fen("d4") + " } "
+        "d5 { " + fen("d4", "d5") + " } 1-0\n"
+    )
+
+    assert [move.name for move in root.children] == ["1. e4", "1. d4"]
+    assert [move.file_header for move in root.children] == [HEADER, second_header]
+    assert [move.name for move in root.children[1].children] == ["d5"]
+    assert root.children[0].children == []
+
+
+def test_construct_tree_final_fen_comment():
+    # -F adds the fen of the final position after the last move
+    root = parse(
+        "1. e4 { " + fen("e4") + " } e5 { " + fen("e4", "e5") + " } "
+        "{ " + fen("e4", "e5") + " } *\n\n"
+        "1. d4 { A comment } { " + fen("d4") + " } "
+        "{ " + fen("d4") + " } *"
+    )
+
+    e5 = root.children[0].children[0]
+    assert (e5.comments, e5.fen) == (None, fen("e4", "e5"))
+    d4 = root.children[1]
+    assert (d4.comments, d4.fen) == ("A comment", fen("d4"))
+
+
+def test_construct_tree_unbalanced_variations():
+    with pytest.raises(ValueError):
+        parse("1. e4 { " + fen("e4") + " } ( 1. d4 { " + fen("d4") + " } *")
+    with pytest.raises(ValueError):
+        parse("1. e4 { " + fen("e4") + " } ) *")
@@ -0,0 +1,123 @@
+"""This module implements the search of the transpositions of a repertoire"""
+
+import csv
+import json
+from pathlib import Path
+
+from move import Move
+from position_index import PositionIndex
+
+
+def walk_lines(root: Move) -> tuple[dict[int, int], set[int]]:
+    """Walk the tree once to get, by id of move, the id of its line (the same
+    for the moves reached by the same positions, like a line repeated in two
+    files) and the moves reaching a position already reached earlier in their
+    line (a repetition)"""
+
+    line_of: dict[int, int] = {}
+    # (id of the parent line, position key) -> id of the line
+    line_ids: dict[tuple[int, str], int] = {}
+    repeated = set()
+    path_keys: list[str] = []
+    # position key -> number of moves of the current line reaching it
+    on_path: dict[str, int] = {}
+    stack = [(0, root)]
+    while len(stack) > 0:
+        depth, move = stack.pop()
+        for fen_key in path_keys[depth:]:
+            on_path[fen_key] -= 1
+        del path_keys[depth:]
+        if on_path.get(move.fen_key, 0) > 0:
+            repeated.add(id(move))
+        path_keys.append(move.fen_key)
+        on_path[move.fen_key] = on_path.get(move.fen_key, 0) + 1
+        parent_line = -1 if move.parent is None else line_of[id(move.parent)]
+        line_of[id(move)] = line_ids.setdefault(
+            (parent_line, move.fen_key), len(line_ids)
+        )
+        for child in reversed(move.children):
+            stack.append((depth + 1, child))
+    return line_of, repeated
+
+
+def is_commented(move: Move) -> bool:
+    """Check if the move, its parent or its children have a "Transposition"
+    comment"""
+
+    commented_moves = [move] + move.children
+    if move.parent is not None:
+        commented_moves.append(move.parent)
+    for commented_move in commented_moves:
+        if (
+            commented_move.comments is not None
+            and commented_move.comments.find("Transposition") > -1
+        ):
+            return True
+    return False
+
+
+def find_transpositions(root: Move) -> list[list[Move]]:
+    """Get the groups of moves reaching the same position by different lines,
+    one move by line, when the lines are not all commented as a transposition
+    yet. The repetitions and the mates are left out"""
+
+    index = PositionIndex(root)
+    line_of, repeated = walk_lines(root)
+    transpositions = []
+    for position_moves in index.positions.values():
+        if len(position_moves) < 2 or position_moves[0].name.endswith("#"):
+            continue
+        # line id -> the moves of this line
+        lines: dict[int, list[Move]] = {}
+        for move in position_moves:
+            if id(move) not in repeated:
+                lines.setdefault(line_of[id(move)], []).append(move)
+        if len(lines) < 2:
+            continue
+        nb_commented = 0
+        for line_moves in lines.values():
+            if any(is_commented(move) for move in line_moves):
+                nb_commented += 1
+        if nb_commented < len(lines) - 1:
+            transpositions.append([line_moves[0] for line_moves in lines.values()])
+    return transpositions
+
+
+def write_transposition_report(transpositions: list[list[Move]], path: Path):
+    """Write the transpositions in a json or a csv file, depending on the
+    extension of the path"""
+
+    if path.suffix == ".json":
+        report = [
+            {
+                "position": moves[0].fen_key,
+                "lines": [
+                    {
+                        "line": move.str_to_root().strip(),
+                        "fen": move.fen,
+                        "comments": move.comments,
+                    }
+                    for move in moves
+                ],
+            }
+            for moves in transpositions
+        ]
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, ensure_ascii=False)
+    elif path.suffix == ".csv":
+        with open(path, "w", encoding="utf-8", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(["transposition", "position", "line", "fen", "comments"])
+            for i, moves in enumerate(transpositions):
+                for move in moves:
+                    writer.writerow(
+                        [
+                            i + 1,
+                            move.fen_key,
+                            move.str_to_root().strip(),
+                            move.fen,
+                            move.comments,
+                        ]
+                    )
+    else:
+        raise ValueError("The report file is not a .json or a .csv file: " + str(path))
@@ -0,0 +1,74 @@
+"""This module implements the iterative traversals of a Move tree"""
+
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from move import Move
+
+
+def preorder(move: "Move | None") -> Iterator["Move"]:
+    """Yield the move and all its children, depth first, in the children order"""
+
+    if move is None:
+        return
+    stack = [move]
+    while len(stack) > 0:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(current.children))
+
+
+def ancestors(move: "Move | None") -> Iterator["Move"]:
+    """Yield the move and its parents up to the root"""
+
+    while move is not None:
+        yield move
+        move = move.parent
+
+
+def tree_path(move: "Move") -> list[int]:
+    """Get the indices of the children going from the root to the move, the
+    moves sorted by it are in preorder"""
+
+    path = []
+    for current in ancestors(move):
+        if current.parent is not None:
+            # compare by identity, the moves are equal if they transpose
+            path.append(
+                next(
+                    i
+                    for i, child in enumerate(current.parent.children)
+                    if child is current
+                )
+            )
+    path.reverse()
+    return path
+
+
+def pgn_order(
+    move: "Move", only_children=False
+) -> Iterator[tuple[str, "Move | None"]]:
+    """Yield the moves in the order of a pgn movetext as ("move", move),
+    ("(", None) and (")", None) items: the main variant move comes first,
+    then the other children as variations, then the main variant continues"""
+
+    stack: list[tuple[str, "Move | None", bool]] = [("subtree", move, only_children)]
+    while len(stack) > 0:
+        kind, current, skip_move = stack.pop()
+        if kind != "subtree":
+            yield kind, current
+            continue
+        if not skip_move:
+            yield "move", current
+        children = sorted(
+            current.children, key=lambda c: int(not c.main_variant)  # type: ignore
+        )
+        if len(children) == 0:
+            continue
+        # pushed in reverse order of the output
+        stack.append(("subtree", children[0], True))
+        for child in reversed(children[1:]):
+            stack.append((")", None, False))
+            stack.append(("subtree", child, False))
+            stack.append(("(", None, False))
+        stack.append(("move", children[0], False))
@@ -1,161 +1,275 @@
+import hashlib
 import pickle
 import re
 import os
+import struct
 import subprocess
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from move import Move
+from repertoire_file import BinaryRepertoire, write_binary_repertoire
+from repertoire_store import SqliteRepertoire
+from traversal import pgn_order
 from dictionaries import evaluation_dict
 
 directory_path = Path(os.path.abspath(os.path.dirname(__file__)))
+pgn_extract_path = directory_path / (
+    "pgn-extract.exe" if os.name == "nt" else "pgn-extract"
+)
+
+# bump it when the Move format or the parsing changes to invalidate cache/pgns
+PGN_CACHE_VERSION = 4
+
+
+_PGN_TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>\{[^}]*\})
+    |(?P<header>\[[^\]]*\])
+    |(?P<result>1-0|0-1|1/2-1/2|\*)
+    |(?P<number>\d+\.+)
+    |(?P<nag>\$\d+)
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<san>[^\s{}()\[\]$]+)
+    """,
+    re.VERBOSE,
+)
+
+
+def construct_tree(root: Move, pgn: str, file_header: str | None) -> Move:
+    """Parse the movetext of a pgn-extract output (with --fencomments) and hang
+    the moves under root. Single pass over the tokens, the variations are
+    handled with an explicit stack so there is no recursion at all. Every game
+    of the output is read, the first move of each game is a child of root and
+    the next games get the headers of the output as file_header."""
+
+    stack: list[Move] = []
+    # the move the next move will follow, the root before the first move
+    last_move = root
+    # the move the next comments and NAGs belong to
+    annotated_move: Move | None = None
+    nb_comments = 0
+    # the comments before a move (of the game or of a variation), they are
+    # kept with the comments of the next move
+    previous_comments: list[str] = []
+    # the headers of the game being read
+    headers: list[str] = []
+    move_number = ""
+    variation_start = False
+    for token in _PGN_TOKEN_RE.finditer(pgn):
+        kind = token.lastgroup
+        value = token.group()
+        if kind == "number":
+            move_number = value
+        elif kind == "san":
+            if last_move is root:
+                if file_header is None and len(headers) > 0:
+                    # a next game of the file
+                    file_header = "\n".join(headers)
+                headers = []
+            new_move = Move(
+                move_number + " " + value if move_number else value,
+                parent=last_move,
+                fen="",
+                comments=" ".join(previous_comments) or None,
+                # only the first move of a variation is not a main variant
+                main_variant=not variation_start,
+                file_header=file_header,
+            )
+            Move.add_child(last_move, new_move)
+            file_header = None
+            variation_start = False
+            move_number = ""
+            previous_comments = []
+            last_move = new_move
+            annotated_move = new_move
+            nb_comments = 0
+        elif kind == "nag":
+            if annotated_move is not None:
+                # assigned so the setter interns the NAG
+                annotated_move.evaluation = (annotated_move.evaluation or []) + [value]
+        elif kind == "comment":
+            text = value[1:-1].replace("\n", " ").strip()
+            if annotated_move is None:
+                previous_comments.append(text)
+            elif nb_comments == 1 and text.strip('"') == annotated_move.fen.strip('"'):
+                # the fen of the final position added by -F, not a comment
+                continue
+            elif nb_comments < 2:
+                # the last comment is the fen from pgn-extract,
+                # if there are two of them the first one is a real comment
+                if nb_comments == 1:
+                    annotated_move.comments = " ".join(
+                        comment
+                        for comment in (annotated_move.comments, annotated_move.fen)
+                        if comment
+                    )
+                annotated_move.fen = text
+                nb_comments += 1
+        elif kind == "open":
+            if last_move.parent is None:
+                raise ValueError(
+                    "A variation starts before any move at: " + str(token.start())
+                )
+            stack.append(last_move)
+            last_move = last_move.parent
+            annotated_move = None
+            variation_start = True
+        elif kind == "close":
+            if len(stack) == 0:
+                raise ValueError(
+                    "No matching opening parens at: " + str(token.start())
+                )
+            last_move = stack.pop()
+            annotated_move = None
+        elif kind == "result" and len(stack) == 0:
+            # the end of a game, the next one starts from root
+            last_move = root
+            annotated_move = None
+            previous_comments = []
+        elif kind == "header":
+            if last_move is not root:
+                # a next game without the result of the previous one
+                last_move = root
+                annotated_move = None
+            previous_comments = []
+            headers.append(value)
+
+    if len(stack) > 0:
+        raise ValueError("No matching closing parens in the pgn")
+    return root
+
+
+def extract_fen_pgn(full_path_file_str: str) -> str:
+    """Run pgn-extract on a pgn file to add the fen comments on every move and
+    read its output directly from the pipe, without any temporary file"""
+
+    completed = subprocess.run(
+        [str(pgn_extract_path), "-F", "--fencomments", full_path_file_str],
+        stdout=subprocess.PIPE,
+        check=True,
+        encoding="utf-8",
+    )
+    return completed.stdout
 
 
-def find_parens(s):
-    toret = {}
-    pstack = []
+def build_file_tree(file: str) -> Move:
+    """Extract the fens of one pgn of the pgns folder with pgn-extract and
+    build its tree under its own fake move"""
 
-    for i, c in enumerate(s):
-        if c == "(":
-            pstack.append(i)
-        elif c == ")":
-            if len(pstack) == 0:
-                raise IndexError("No matching closing parens at: " + str(i))
-            toret[pstack.pop()] = i
+    file_move = Move("", fen="w ")
+    full_path_file_str = str(directory_path / "pgns" / file)
+    fen_pgn = extract_fen_pgn(full_path_file_str)
+    header_file = open(full_path_file_str, encoding="utf-8")
+    header_pgn = header_file.read()
+    header_file.close()
+    file_header = header_pgn[0 : header_pgn.find("\n\n")]
+    return construct_tree(file_move, fen_pgn, file_header)
 
-    if len(pstack) > 0:
-        raise IndexError("No matching opening parens at: " + str(pstack.pop()))
 
-    return toret
+def cache_file_tree(file: str, path: Path):
+    """Build the tree of one pgn and write it to its cache file. The workers
+    give back the tree through this file, not as a nested Move tree which is
+    pickled recursively"""
 
+    write_binary_repertoire(path, build_file_tree(file))
 
-def construct_tree(move, pgn, nb, file_header):
-    if len(nb) == 0:
-        return
-    if pgn[nb[0].start() - 1] == "(":
-        start_bracket_idx = pgn.find("{", pgn.find(" ", nb[0].end() + 1))
-        end_bracket_idx = pgn.find("}", start_bracket_idx)
-        comment = pgn[start_bracket_idx + 2 : end_bracket_idx - 1]
-        fen = None
-        evaluation_idx = pgn.find(
-            "$", pgn.find(" ", nb[0].end() + 1), start_bracket_idx
-        )
-        if pgn.find("{", end_bracket_idx, end_bracket_idx + 3) > -1:
-            fen = pgn[
-                pgn.find("{", end_bracket_idx) + 2 : pgn.find("}", end_bracket_idx + 1)
-            ]
 
-        new_move = Move(
-            pgn[nb[0].start() : pgn.find(" ", nb[0].end() + 1)],
-            parent=move.parent,
-            fen=fen if fen is not None else comment,
-            comments=comment if fen is not None else None,
-            evaluation=(
-                pgn[evaluation_idx:start_bracket_idx].split(" ")[:-1]
-                if evaluation_idx >= 0
-                else None
-            ),
-            main_variant=False,
-        )
-        Move.add_child(move.parent, new_move)
-        ending_parenthesis = find_parens(pgn)[nb[0].start() - 1]
-        sub_pgn = pgn[nb[0].start() : ending_parenthesis]
-        new_nb = list(re.finditer(r"\d+\.+(?![^{]*})", sub_pgn))
-        new_nb.pop(0)
-        construct_tree(new_move, sub_pgn, new_nb, None)
-        return construct_tree(
-            move,
-            pgn[ending_parenthesis + 1 :],
-            list(re.finditer(r"\d+\.+(?![^{]*})", pgn[ending_parenthesis + 1 :])),
-            None,
-        )
-    else:
-        start_bracket_idx = pgn.find("{", pgn.find(" ", nb[0].end() + 1))
-        end_bracket_idx = pgn.find("}", start_bracket_idx)
-        comment = pgn[start_bracket_idx + 2 : end_bracket_idx - 1]
-        fen = None
-        evaluation_idx = pgn.find(
-            "$", pgn.find(" ", nb[0].end() + 1), start_bracket_idx
-        )
-        if pgn.find("{", end_bracket_idx, end_bracket_idx + 3) > -1:
-            fen = pgn[
-                pgn.find("{", end_bracket_idx) + 2 : pgn.find("}", end_bracket_idx + 1)
-            ]
+def pgn_extract_version() -> str:
+    """Get the version line of the pgn-extract executable"""
 
-        new_move = Move(
-            pgn[nb[0].start() : pgn.find(" ", nb[0].end() + 1)],
-            parent=move,
-            fen=fen if fen is not None else comment,
-            comments=comment if fen is not None else None,
-            evaluation=(
-                pgn[evaluation_idx:start_bracket_idx].split(" ")[:-1]
-                if evaluation_idx >= 0
-                else None
-            ),
-            main_variant=True,
-            file_header=file_header if pgn[0:3] == "1. " else None,
-        )
-        Move.add_child(move, new_move)
-        nb.pop(0)
-        construct_tree(new_move, pgn, nb, None)
+    version = subprocess.check_output([str(pgn_extract_path), "--version"], text=True)
+    return version.strip()
+
+
+def pgn_cache_key(file: str, version: str) -> str:
+    """Hash the content of a pgn file with the pgn-extract version that
+    extracts it and the version of the cache format"""
+
+    with open(directory_path / "pgns" / file, "rb") as handle:
+        content = handle.read()
+    digest = hashlib.sha256()
+    digest.update((str(PGN_CACHE_VERSION) + "\n" + version + "\n").encode("utf-8"))
+    digest.update(content)
+    return digest.hexdigest()
+
+
+def read_cached_tree(path: Path) -> Move | None:
+    """Read a tree cached as a binary repertoire, None if it is not there or
+    not readable"""
+
+    try:
+        repertoire = BinaryRepertoire(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    try:
+        return repertoire.read_tree()
+    except (ValueError, struct.error):
+        return None
+    finally:
+        repertoire.close()
 
 
-def read_and_build_tree():
+def read_and_build_tree(workers: int | None = None):
+    """Build the tree of all the pgns folder under a fake move. The files are
+    parsed in a pool of workers processes (os.cpu_count() by default, 1 to stay
+    in this process) and merged in the file name order. The tree of each file
+    is cached by content hash in cache/pgns as a binary repertoire (not a
+    pickle, which recurses on the long lines) so only the modified files are
+    parsed again"""
+
+    files = sorted(
+        file
+        for file in os.listdir(directory_path / "pgns")
+        if file.endswith(".pgn") and file != "game1.pgn"
+    )
+    if workers is None:
+        workers = os.cpu_count() or 1
     while True:
         fake_move = Move("", fen="w ")
         try:
-            for file in os.listdir(directory_path / "pgns"):
-                full_path_file = directory_path / "pgns" / file
-                full_path_file_str = str(full_path_file)
-                if file.endswith(".pgn") and file != "game1.pgn":
-                    pgn_extract_str_path = str(directory_path / "pgn-extract") # if os windows, add .exe
-                    temp_file_str_path = full_path_file_str+"_temp.pgn"
-                    subprocess.check_call(
-                        [
-                            pgn_extract_str_path,
-                            "-F",
-                            "--fencomments",
-                            full_path_file_str,
-                            "-o",
-                            temp_file_str_path,
-                        ]
-                    )
-
-                    temp_pgn = open(full_path_file_str + "_temp.pgn", encoding="utf-8")
-                    fen_pgn = temp_pgn.read()
-                    temp_pgn.close()
-                    header_file = open(full_path_file_str, encoding="utf-8")
-                    header_pgn = header_file.read()
-                    header_file.close()
-                    file_header = header_pgn[0 : header_pgn.find("\n\n")]
-                    fen_pgn = fen_pgn.replace("\n", " ")
-                    fen_pgn = re.sub(
-                        r"\( \d+\.",
-                        lambda match: match.group(0).replace(" ", ""),
-                        fen_pgn,
+            version = pgn_extract_version()
+            keys = [pgn_cache_key(file, version) for file in files]
+            cache_path = directory_path / "cache" / "pgns"
+            cache_path.mkdir(parents=True, exist_ok=True)
+            file_moves = [
+                read_cached_tree(cache_path / (key + ".bin")) for key in keys
+            ]
+            to_parse = [i for i, move in enumerate(file_moves) if move is None]
+            to_parse_files = [files[i] for i in to_parse]
+            to_parse_paths = [cache_path / (keys[i] + ".bin") for i in to_parse]
+            if workers > 1 and len(to_parse) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    # wait for all of them, and raise their errors
+                    list(
+                        executor.map(cache_file_tree, to_parse_files, to_parse_paths)
                     )
-
-                    fen_pgn = fen_pgn[fen_pgn.find("1. ") :]
-                    # print(fen_pgn)
-
-                    # find all the main moves number and put it in the nb list
-                    nb = list(re.finditer(r"\d+\.+(?![^{]*})", fen_pgn))
-                    construct_tree(fake_move, fen_pgn, nb, file_header)
-            remove_temp_pgn()
+            else:
+                for file, path in zip(to_parse_files, to_parse_paths):
+                    cache_file_tree(file, path)
+            for i, path in zip(to_parse, to_parse_paths):
+                file_moves[i] = read_cached_tree(path)
+            # remove the cached trees of the files that changed or disappeared
+            used_files = {key + ".bin" for key in keys}
+            for cache_file in os.listdir(cache_path):
+                if cache_file not in used_files:
+                    os.remove(cache_path / cache_file)
+            for file_move in file_moves:
+                # every file is either cached or parsed by now
+                assert file_move is not None
+                for child in file_move.children:
+                    child.parent = fake_move
+                    fake_move.add_child(child)
             return fake_move
         except subprocess.CalledProcessError as inst:
             print(
                 "--------------------- ERROR: " + str(inst) + " ---------------------"
             )
-            remove_temp_pgn()
 
 
 def repertoire_to_pgn(b_or_w):
-    with open(
-        directory_path / "repertoire" / (b_or_w + ".repertoire.pickle"),
-        "rb",
-    ) as handle:
-        fake_move: Move = pickle.load(handle)
+    fake_move, _ = load_repertoire(b_or_w)
     for i, child in enumerate(fake_move.children):
         if child.file_header:
             white_idx = child.file_header.find("White ")
@@ -185,21 +299,20 @@ def repertoire_to_pgn(b_or_w):
 def build_pgn_move(move: Move | None, only_children=False) -> str:
     if move is None:
         return ""
-    if only_children:
-        move_str = ""
-    else:
-        move_str = build_move_unitary(move)
-    if move.children:
-        move.children.sort(key=lambda c: int(not c.main_variant))
-        move_str += " " + build_move_unitary(move.children[0])
-        for c in move.children[1:]:
-            move_str += " ("
-            move_str += build_pgn_move(c)
-            move_str += ")"
-        move_str += build_pgn_move(move.children[0], True)
-    else:
-        return move_str
-    return move_str
+    move_str = []
+    # the only_children pgn starts with a space as it follows its parent move
+    previous_kind = "move" if only_children else "("
+    for kind, current in pgn_order(move, only_children):
+        if kind == "move":
+            if previous_kind != "(":
+                move_str.append(" ")
+            move_str.append(build_move_unitary(current))  # type: ignore
+        elif kind == "(":
+            move_str.append(" (")
+        else:
+            move_str.append(")")
+        previous_kind = kind
+    return "".join(move_str)
 
 
 def build_move_unitary(move: Move):
@@ -212,16 +325,6 @@ def build_move_unitary(move: Move):
     return move.name + move_eval + comment
 
 
-def traversal_tree(move: Move, fens: list[str], moves: list[Move]):
-    if move is not None:
-        # get the fen with the color but without the move order, castle, etc. to find transposition
-        fens.append(move.fen[: move.fen.find(" ", move.fen.find(" ") + 1)])
-        moves.append(move)
-        for child in move.children:
-            traversal_tree(child, fens, moves)
-    return fens, moves
-
-
 def french_chess(string):
     last = (
         string.replace("N", "C")
@@ -243,34 +346,6 @@ def is_not_a_bad_move(move):
     return True
 
 
-def remove_temp_pgn(path=directory_path / "pgns"):
-    for file in os.listdir(path):
-        if file.endswith("_temp.pgn"):
-            if os.path.exists(path / file):
-                os.remove(path / file)
-
-
-def find_all_children(
-    transposition_dict, fen, moves, move_idx, remove_from_dict=False
-) -> list[Move]:
-    all_children = moves[move_idx].children
-    if fen in list(transposition_dict.keys()):
-        # the fen is found in other files
-        all_children = []
-        for idx in transposition_dict[fen]:
-            all_children += moves[idx].children
-        if remove_from_dict:
-            transposition_dict.pop(fen)
-    return list(set(all_children))
-
-
-def build_fen_dict(fens):
-    transposition_dict = defaultdict(list)
-    for i, item in enumerate(fens):
-        transposition_dict[item].append(i)
-    return {k: v for k, v in transposition_dict.items() if len(v) > 1}
-
-
 def pgn_to_evaluation(evaluation):
     beautiful_str = ""
     if evaluation is None:
@@ -298,12 +373,40 @@ def move_full_print(move):
 
 
 def save_to_repertoire(b_or_w, fake_move):
+    if parse_config().get("repertoire_store") == "sqlite":
+        store = SqliteRepertoire(
+            directory_path / "repertoire" / (b_or_w + ".repertoire.sqlite")
+        )
+        store.save_tree(fake_move)
+        store.close()
+    else:
+        write_binary_repertoire(
+            directory_path / "repertoire" / (b_or_w + ".repertoire.bin"), fake_move
+        )
+    print("repertoire saved!")
+
+
+def load_repertoire(
+    b_or_w,
+) -> tuple[Move, BinaryRepertoire | SqliteRepertoire | None]:
+    """Open the repertoire of this color, its moves are read lazily from the
+    sqlite store if it is the configured one, else from the binary file.
+    Fall back to the repertoire pickle saved before the binary format"""
+
+    sqlite_path = directory_path / "repertoire" / (b_or_w + ".repertoire.sqlite")
+    if parse_config().get("repertoire_store") == "sqlite" and sqlite_path.exists():
+        store = SqliteRepertoire(sqlite_path)
+        return store.root(), store
+    binary_path = directory_path / "repertoire" / (b_or_w + ".repertoire.bin")
+    if binary_path.exists():
+        repertoire = BinaryRepertoire(binary_path)
+        return repertoire.root(), repertoire
     with open(
         directory_path / "repertoire" / (b_or_w + ".repertoire.pickle"),
-        "wb",
+        "rb",
     ) as handle:
-        pickle.dump(fake_move, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    print("repertoire saved!")
+        return pickle.load(handle), None
+
 
 def parse_config():
     raw_config = open(directory_path / "configuration.txt", "r", encoding="utf-8")
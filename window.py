@@ -22,6 +22,10 @@ class Window:
         """
 
         self.window: Tk = Tk()
+        # the repaint asked with update_canvas, done once the window is idle
+        self.redraw_id: str | None = None
+        self.board_dirty = False
+        self.background_dirty = False
         self.init_window(
             init_width=init_width, init_height=init_height, init_x=init_x, init_y=init_y
         )
@@ -64,9 +68,20 @@ class Window:
         self.window.title("Chess")
         self.window.protocol("WM_DELETE_WINDOW", self.destroy_window)
 
-    def update_canvas(self, _):
-        """Update all the canvas when the window is resizing"""
+    def update_canvas(self, _, board=True, background=True):
+        """Ask for a repaint of the board and/or the background, when the
+        window is resizing or the game changed. All the repaints asked until
+        the window is idle are done at once"""
 
+        self.board_dirty = self.board_dirty or board
+        self.background_dirty = self.background_dirty or background
+        if self.redraw_id is None:
+            self.redraw_id = self.window.after_idle(self.redraw)
+
+    def redraw(self):
+        """Update all the canvas asked since the last repaint"""
+
+        self.redraw_id = None
         window_width: int = self.window.winfo_width()
         window_height: int = self.window.winfo_height()
 
@@ -75,13 +90,21 @@ class Window:
         else:
             base_length: int = window_width
 
-        self.background.update(
-            window=self.window,
-            play_random=self.board.play_random,
-            board_width=self.board.board_width,
-            board_position=self.board.board_position,
-        )
-        self.board.update(base_length=base_length)
+        if self.board_dirty:
+            board_geometry = (self.board.board_width, self.board.board_position)
+            self.board.update(base_length=base_length)
+            if (self.board.board_width, self.board.board_position) != board_geometry:
+                # the background is laid out around the board, with its new size
+                self.background_dirty = True
+        if self.background_dirty:
+            self.background.update(
+                window=self.window,
+                play_random=self.board.play_random,
+                board_width=self.board.board_width,
+                board_position=self.board.board_position,
+            )
+        self.board_dirty = False
+        self.background_dirty = False
 
     def bind_events(self):
         """Bind the events to the fcts for the different canvas"""
@@ -90,6 +113,10 @@ class Window:
         self.board.bind()
 
     def destroy_window(self):
-        if self.board.stockfish_sub_process is not None:
-            self.board.stockfish_sub_process.kill()
+        if self.redraw_id is not None:
+            self.window.after_cancel(self.redraw_id)
+        self.background.stop_stockfish_refresh()
+        if self.board.engine is not None:
+            self.board.engine.quit()
+        self.board.repertoire_index.close()
         self.window.destroy()